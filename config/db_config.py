@@ -10,4 +10,9 @@ DB_CONFIG = {
     "dbname": os.getenv("DB_NAME", "po_db"),
     "user": os.getenv("DB_USER", "garvitgupta"),
     "password": os.getenv("DB_PASS", "")
-}
\ No newline at end of file
+}
+# Connection Pool Settings (shared by agent, insert path and invoice generator)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Connections idle longer than this (seconds) are pinged before being handed out
+DB_POOL_HEALTHCHECK_IDLE = int(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))
@@ -27,4 +27,74 @@ CREATE TABLE IF NOT EXISTS purchase_order_items (
     line_total NUMERIC(15, 2)
 );
 
+-- Durable agent job queue (drained by services/agent_worker_service.py)
+CREATE TABLE IF NOT EXISTS agent_jobs (
+    job_id BIGSERIAL PRIMARY KEY,
+    job_type VARCHAR(50) NOT NULL,
+    po_id INT REFERENCES purchase_orders(po_id) ON DELETE CASCADE,
+    payload TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    locked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_agent_jobs_ready
+    ON agent_jobs (run_after, job_id) WHERE status = 'queued';
+
+-- Ingestion manifest (replaces manifest.json; see scripts/migrate_manifest.py)
+CREATE TABLE IF NOT EXISTS po_manifest (
+    file_name VARCHAR(255) PRIMARY KEY,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    email_metadata TEXT,
+    json_name VARCHAR(255),
+    error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_po_manifest_pending
+    ON po_manifest (created_at) WHERE status = 'pending';
+
+CREATE TABLE IF NOT EXISTS layout_templates (
+    sender_key VARCHAR(255) PRIMARY KEY,
+    template TEXT NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS po_allocations (
+    po_id INT PRIMARY KEY REFERENCES purchase_orders(po_id) ON DELETE CASCADE,
+    accepted_partial BOOLEAN NOT NULL,
+    outcome VARCHAR(20) NOT NULL,
+    decisions TEXT NOT NULL,
+    job_id BIGINT,
+    locked_at TIMESTAMP,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS imap_checkpoint (
+    mailbox VARCHAR(255) PRIMARY KEY,
+    uidvalidity BIGINT NOT NULL,
+    last_uid BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ingested_messages (
+    message_id VARCHAR(998) PRIMARY KEY,
+    from_email TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS ingested_files (
+    sha256 CHAR(64) PRIMARY KEY,
+    file_name VARCHAR(255) NOT NULL,
+    message_id VARCHAR(998),
+    duplicates INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- Note: 'inventory' table is created by load_data.py
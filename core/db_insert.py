@@ -1,12 +1,9 @@
 import json
-import psycopg2
-from config.db_config import DB_CONFIG
+from core.db_pool import get_connection, ensure_tables
+from core.job_queue import enqueue_job, JOB_PROCESS_PO
 
 
 def insert_po(final_json, sender_email=None):
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor()
-
     d = final_json["extracted_data"]
 
     buyer = d.get("buyer", {})
@@ -22,16 +19,7 @@ def insert_po(final_json, sender_email=None):
             
     print(f"📧 Sender Email for DB: {sender_email}")
 
-    # -------- INSERT PO HEADER --------
-    cur.execute("""
-        INSERT INTO purchase_orders (
-            po_number, po_date, buyer, supplier,
-            buyer_gst, supplier_gst, currency,
-            total_amount, raw_json, sender_email
-        )
-        VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        RETURNING po_id
-    """, (
+    header = (
         d.get("po_number"),
         d.get("po_date") or None,
         buyer.get("company_name"),
@@ -42,37 +30,73 @@ def insert_po(final_json, sender_email=None):
         d.get("total_amount"),
         json.dumps(final_json),    # FULL JSON stored safely
         sender_email               # FROM EMAIL (Ingestion)
-    ))
+    )
 
-    po_id = cur.fetchone()[0]
-
-    # -------- INSERT LINE ITEMS --------
-    for item in d.get("line_items", []):
-        cur.execute("""
-            INSERT INTO purchase_order_items (
-                po_id, product_id, product_name,
-                quantity, unit_price, line_total
-            )
-            VALUES (%s,%s,%s,%s,%s,%s)
-        """, (
-            po_id,
+    items = [
+        (
             item.get("product_id"),
             item.get("description"),
             _safe_int(item.get("quantity")),
             _safe_numeric(item.get("unit_price")),
             _safe_numeric(item.get("line_total"))
-        ))
+        )
+        for item in d.get("line_items", [])
+    ]
 
-    conn.commit()
-    cur.close()
-    conn.close()
+    ensure_tables()
 
-    # -------- TRIGGER AGENT --------
-    try:
-        from core.optimized_agent import process_po
-        process_po(po_id)
-    except Exception as e:
-        print(f"Agent failed to process PO {po_id}: {e}")
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # -------- INSERT PO HEADER + LINE ITEMS (one round trip) --------
+        header_sql = cur.mogrify("(%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)", header)
+
+        if items:
+            # Casts keep column types stable when a whole column is NULL
+            values_sql = b",".join(
+                cur.mogrify("(%s::text,%s::text,%s::int,%s::numeric,%s::numeric)", row)
+                for row in items
+            )
+            cur.execute(b"""
+                WITH po AS (
+                    INSERT INTO purchase_orders (
+                        po_number, po_date, buyer, supplier,
+                        buyer_gst, supplier_gst, currency,
+                        total_amount, raw_json, sender_email
+                    )
+                    VALUES """ + header_sql + b"""
+                    RETURNING po_id
+                ), items AS (
+                    INSERT INTO purchase_order_items (
+                        po_id, product_id, product_name,
+                        quantity, unit_price, line_total
+                    )
+                    SELECT po.po_id, v.product_id, v.product_name,
+                           v.quantity, v.unit_price, v.line_total
+                    FROM po, (VALUES """ + values_sql + b""")
+                        AS v(product_id, product_name, quantity, unit_price, line_total)
+                )
+                SELECT po_id FROM po
+            """)
+        else:
+            cur.execute(b"""
+                INSERT INTO purchase_orders (
+                    po_number, po_date, buyer, supplier,
+                    buyer_gst, supplier_gst, currency,
+                    total_amount, raw_json, sender_email
+                )
+                VALUES """ + header_sql + b"""
+                RETURNING po_id
+            """)
+
+        po_id = cur.fetchone()[0]
+
+        # -------- QUEUE AGENT (commits with the PO) --------
+        # services/agent_worker_service.py picks it up; OCR moves on immediately
+        job_id = enqueue_job(cur, JOB_PROCESS_PO, po_id)
+
+    print(f"📥 PO {po_id} queued for agent (job {job_id})")
+    return po_id
 
 
 def _safe_numeric(val):
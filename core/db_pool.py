@@ -0,0 +1,155 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+
+from config.db_config import (
+    DB_CONFIG,
+    DB_POOL_MIN,
+    DB_POOL_MAX,
+    DB_POOL_HEALTHCHECK_IDLE,
+)
+
+# ============================================================
+# PROCESS-WIDE CONNECTION POOL
+# ============================================================
+# One pool per process. Checkout blocks (instead of raising) when all
+# DB_POOL_MAX connections are busy, so bursts queue up in the app rather
+# than exhausting Postgres max_connections.
+
+_pool = None
+_pool_pid = None
+_slots = None
+_last_used = {}
+_lock = threading.Lock()
+
+# config/schema.sql is the single source of the schema: it initialises a new
+# database (docker-entrypoint-initdb.d) and ensure_tables() replays it on
+# databases created before a table was added
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config", "schema.sql")
+SCHEMA_LOCK_KEY = 727001      # pg_advisory_xact_lock key: one process applies the DDL at a time
+_tables_ready = False
+
+
+def get_pool():
+    """Return the pool for this process, creating it on first use (or after a fork)."""
+    global _pool, _pool_pid, _slots
+
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # A pool inherited from a parent process shares its sockets; never reuse it
+            _pool = pg_pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_CONFIG)
+            _pool_pid = os.getpid()
+            _slots = threading.BoundedSemaphore(DB_POOL_MAX)
+            _last_used.clear()
+    return _pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < DB_POOL_HEALTHCHECK_IDLE:
+        return True
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def _checkout():
+    p = get_pool()
+    _slots.acquire()
+    try:
+        # One retry is enough: a second dead connection means the server is down
+        for _ in range(2):
+            conn = p.getconn()
+            if _is_healthy(conn):
+                return conn
+            print("⚠️ Discarding stale DB connection from pool")
+            _last_used.pop(id(conn), None)
+            p.putconn(conn, close=True)
+        return p.getconn()
+    except Exception:
+        _slots.release()
+        raise
+
+
+def _checkin(conn, discard=False):
+    p = get_pool()
+    try:
+        if discard or conn.closed:
+            _last_used.pop(id(conn), None)
+            p.putconn(conn, close=True)
+        else:
+            _last_used[id(conn)] = time.monotonic()
+            p.putconn(conn)
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def get_connection():
+    """
+    Check out a pooled connection for one unit of work.
+    Commits on success, rolls back on error, and always returns the connection.
+
+        with get_connection() as conn:
+            cur = conn.cursor()
+            ...
+    """
+    conn = _checkout()
+    discard = False
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        try:
+            conn.rollback()
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            discard = True
+        raise
+    finally:
+        _checkin(conn, discard=discard)
+
+
+def ensure_tables():
+    """
+    Apply config/schema.sql (all CREATE ... IF NOT EXISTS) once per process.
+    Services call it at startup; modules owning a table call it before
+    their first query, so scripts and the dashboard work on older databases too.
+    """
+    global _tables_ready
+    if _tables_ready:
+        return
+
+    with open(SCHEMA_FILE) as f:
+        ddl = f.read()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        # Concurrent CREATE TABLE IF NOT EXISTS can still collide in the catalog
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+        cur.execute(ddl)
+    _tables_ready = True
+
+
+def close_pool():
+    """Close every connection in this process's pool (e.g. on service shutdown)."""
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+        _last_used.clear()
@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import time
+
+# ============================================================
+# CONTENT-ADDRESSED EXTRACTION CACHE
+# ============================================================
+# Re-sent POs (reminders, forwards) and retried failures have identical
+# bytes, so OCR text and LLM output are cached on disk keyed by SHA-256
+# of the file. Entries are written atomically (temp file + rename) so
+# parallel OCR workers can share the directory, and the least recently
+# used files are evicted once the cache grows past its size budget.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", os.path.join(BASE_DIR, "cache"))
+CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "1") == "1"
+CACHE_MAX_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "512")) * 1024 * 1024
+# Other processes write to the same directory, so the running size estimate
+# is re-measured at least this often
+EVICT_SCAN_INTERVAL = 300     # seconds
+
+_size_lock = threading.Lock()
+_approx_bytes = None          # None = not measured yet in this process
+_last_scan = 0.0
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _path(kind, key, ext):
+    return os.path.join(CACHE_DIR, kind, key[:2], f"{key}.{ext}")
+
+
+def _read(path):
+    try:
+        with open(path, "r") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # Touch so eviction treats this as recently used
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return data
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _account(len(data.encode()) if isinstance(data, str) else len(data))
+
+
+def _account(written):
+    """
+    Keep a running size estimate instead of walking the cache on every
+    write; only walk (and evict) when the estimate passes the budget or
+    the last measurement is stale.
+    """
+    global _approx_bytes, _last_scan
+    with _size_lock:
+        if _approx_bytes is not None:
+            _approx_bytes += written
+        stale = time.monotonic() - _last_scan > EVICT_SCAN_INTERVAL
+        if _approx_bytes is not None and _approx_bytes <= CACHE_MAX_BYTES and not stale:
+            return
+        _approx_bytes = _evict()
+        _last_scan = time.monotonic()
+
+
+def _evict():
+    """Walk the cache, drop least recently used files if over budget. Returns the size left."""
+    files = []
+    total = 0
+    for root, _, names in os.walk(CACHE_DIR):
+        for name in names:
+            if name.endswith(".tmp"):
+                continue
+            p = os.path.join(root, name)
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+
+    if total <= CACHE_MAX_BYTES:
+        return total
+
+    # Oldest first, down to 90% so we don't evict on every write
+    target = CACHE_MAX_BYTES * 0.9
+    for _, size, p in sorted(files):
+        try:
+            os.remove(p)
+            total -= size
+        except OSError:
+            pass
+        if total <= target:
+            break
+    return total
+
+# ============================================================
+# OCR TEXT
+# ============================================================
+
+def get_text(file_hash, variant=""):
+    if not CACHE_ENABLED:
+        return None
+    return _read(_path("text", f"{file_hash}{variant}", "txt"))
+
+
+def put_text(file_hash, text, variant=""):
+    if CACHE_ENABLED:
+        _write(_path("text", f"{file_hash}{variant}", "txt"), text)
+
+# ============================================================
+# PAGE LAYOUT (words, boxes, rows - see core/page_layout.py)
+# ============================================================
+
+def get_layout(file_hash, variant=""):
+    if not CACHE_ENABLED:
+        return None
+    raw = _read(_path("layout", f"{file_hash}{variant}", "json"))
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def put_layout(file_hash, pages, variant=""):
+    if CACHE_ENABLED:
+        _write(_path("layout", f"{file_hash}{variant}", "json"), json.dumps(pages))
+
+# ============================================================
+# LLM EXTRACTION
+# ============================================================
+
+def _llm_key(file_hash, model, prompt_version, text):
+    # The text actually sent: preprocessing, DPI or layout changes give a new key
+    text_hash = hashlib.sha256(text.encode()).hexdigest()
+    return hashlib.sha256(f"{file_hash}|{model}|{prompt_version}|{text_hash}".encode()).hexdigest()
+
+
+def get_extraction(file_hash, model, prompt_version, text):
+    if not CACHE_ENABLED:
+        return None
+    raw = _read(_path("llm", _llm_key(file_hash, model, prompt_version, text), "json"))
+    if raw is None:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def put_extraction(file_hash, model, prompt_version, text, data):
+    if CACHE_ENABLED:
+        _write(_path("llm", _llm_key(file_hash, model, prompt_version, text), "json"), json.dumps(data))
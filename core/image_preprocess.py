@@ -0,0 +1,153 @@
+import os
+import time
+import numpy as np
+import cv2
+
+# ============================================================
+# PAGE IMAGE PREPROCESSING (before PaddleOCR)
+# ============================================================
+# Phone photos and 300 dpi scans are far bigger than OCR needs, often
+# tilted and surrounded by margin. Each stage below works on a grayscale
+# uint8 image; OCR_PREPROCESS picks the stages and their order.
+#
+# Stages return (image, inverse) where inverse is the 3x3 matrix mapping
+# output pixel coordinates back to input ones (None = unchanged), so OCR
+# boxes can be located on the original page render.
+
+OCR_PREPROCESS = [s.strip() for s in os.getenv("OCR_PREPROCESS", "resize,deskew,crop").split(",") if s.strip()]
+OCR_TARGET_LONG_SIDE = int(os.getenv("OCR_TARGET_LONG_SIDE", "1600"))   # pixels
+OCR_MAX_SKEW = float(os.getenv("OCR_MAX_SKEW", "5"))                    # degrees
+CROP_MARGIN = 10                                                         # pixels
+SKEW_STEP = 0.5                                                          # degrees
+SKEW_PROBE_SIDE = 800                                                    # pixels
+
+
+def _binary_ink(gray):
+    """Ink = 255, paper = 0 (Otsu on a lightly blurred copy)."""
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+    _, ink = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return ink
+
+
+def resize(gray):
+    """Downscale so the long side is OCR_TARGET_LONG_SIDE (never upscales)."""
+    h, w = gray.shape[:2]
+    scale = OCR_TARGET_LONG_SIDE / max(h, w)
+    if scale >= 1:
+        return gray, None
+    nw, nh = max(1, int(w * scale)), max(1, int(h * scale))
+    out = cv2.resize(gray, (nw, nh), interpolation=cv2.INTER_AREA)
+    return out, np.diag([w / nw, h / nh, 1.0])
+
+
+def crop(gray):
+    """Trim blank margins down to the ink bounding box."""
+    ink = _binary_ink(gray)
+    # Drop isolated specks (scanner dust) so they don't stretch the box
+    ink = cv2.morphologyEx(ink, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    points = cv2.findNonZero(ink)
+    if points is None:
+        return gray, None
+
+    x, y, w, h = cv2.boundingRect(points)
+    H, W = gray.shape[:2]
+    x0, y0 = max(0, x - CROP_MARGIN), max(0, y - CROP_MARGIN)
+    x1, y1 = min(W, x + w + CROP_MARGIN), min(H, y + h + CROP_MARGIN)
+    return gray[y0:y1, x0:x1], np.array([[1.0, 0, x0], [0, 1.0, y0], [0, 0, 1.0]])
+
+
+def _rotation(img, angle):
+    h, w = img.shape[:2]
+    return cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+
+
+def _rotate(img, angle, border, m=None):
+    h, w = img.shape[:2]
+    m = _rotation(img, angle) if m is None else m
+    return cv2.warpAffine(img, m, (w, h), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+
+def estimate_skew(gray):
+    """
+    Angle (degrees) that makes text lines horizontal: the rotation whose
+    row profile is sharpest. Probed on a small copy, so it's cheap.
+    """
+    ink = _binary_ink(gray)
+    scale = SKEW_PROBE_SIDE / max(ink.shape[:2])
+    if scale < 1:
+        ink = cv2.resize(ink, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-OCR_MAX_SKEW, OCR_MAX_SKEW + SKEW_STEP / 2, SKEW_STEP):
+        profile = _rotate(ink, angle, 0).sum(axis=1, dtype=np.float64)
+        score = float(np.var(profile))
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def deskew(gray):
+    angle = estimate_skew(gray)
+    if abs(angle) < SKEW_STEP:
+        return gray, None
+    m = _rotation(gray, angle)
+    inverse = np.vstack([cv2.invertAffineTransform(m), [0, 0, 1.0]])
+    return _rotate(gray, angle, 255, m), inverse
+
+
+def threshold(gray):
+    """Adaptive binarisation for uneven lighting (photos, shadows)."""
+    return cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15), None
+
+
+STAGES = {
+    "resize": resize,
+    "crop": crop,
+    "deskew": deskew,
+    "threshold": threshold
+}
+
+for _name in OCR_PREPROCESS:
+    if _name not in STAGES:
+        print(f"⚠️ Unknown OCR_PREPROCESS stage '{_name}' ignored (known: {', '.join(STAGES)})")
+
+
+def signature():
+    """Identifies the configured pipeline (part of the OCR text cache key)."""
+    params = {"resize": OCR_TARGET_LONG_SIDE, "deskew": OCR_MAX_SKEW}
+    return "+".join(f"{s}{params.get(s, '')}" for s in OCR_PREPROCESS) or "none"
+
+
+def preprocess(gray, stages=None):
+    """
+    Run the configured stages in order; logs the size change and per-stage
+    timing. Returns (image, transform): transform maps coordinates in the
+    returned image to coordinates in the input image.
+    """
+    stages = OCR_PREPROCESS if stages is None else stages
+    transform = np.eye(3)
+    if not stages:
+        return gray, transform
+
+    before = gray.shape[:2]
+    timings = []
+    for name in stages:
+        fn = STAGES.get(name)
+        if fn is None:
+            continue
+        start = time.perf_counter()
+        gray, inverse = fn(gray)
+        if inverse is not None:
+            transform = transform @ inverse
+        timings.append(f"{name} {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    after = gray.shape[:2]
+    print(f"🧹 Preprocessed {before[1]}x{before[0]} -> {after[1]}x{after[0]}: {', '.join(timings)}")
+    return gray, transform
+
+
+def to_source(transform, points):
+    """Map [[x, y], ...] from the preprocessed image back to the input image."""
+    pts = np.hstack([np.asarray(points, dtype=np.float64), np.ones((len(points), 1))])
+    return (pts @ transform.T)[:, :2]
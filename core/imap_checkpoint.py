@@ -0,0 +1,37 @@
+from core.db_pool import get_connection, ensure_tables
+
+# ============================================================
+# IMAP UID CHECKPOINT
+# ============================================================
+# Last UID ingested per mailbox, so a restart resumes exactly where it
+# stopped. UIDs are only meaningful for one UIDVALIDITY: if the server
+# reports a different one, the mailbox was rebuilt and the stored UID
+# must be discarded.
+
+def get_last_uid(mailbox, uidvalidity):
+    """Last ingested UID, or 0 if there is none for this UIDVALIDITY."""
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT uidvalidity, last_uid FROM imap_checkpoint WHERE mailbox = %s", (mailbox,))
+        row = cur.fetchone()
+
+    if not row:
+        return 0
+    if row[0] != uidvalidity:
+        print(f"⚠️ UIDVALIDITY of {mailbox} changed ({row[0]} -> {uidvalidity}), checkpoint reset")
+        return 0
+    return row[1]
+
+
+def save_last_uid(mailbox, uidvalidity, uid):
+    ensure_tables()
+    with get_connection() as conn:
+        conn.cursor().execute("""
+            INSERT INTO imap_checkpoint (mailbox, uidvalidity, last_uid)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (mailbox) DO UPDATE
+            SET uidvalidity = EXCLUDED.uidvalidity,
+                last_uid = EXCLUDED.last_uid,
+                updated_at = CURRENT_TIMESTAMP
+        """, (mailbox, uidvalidity, uid))
@@ -0,0 +1,275 @@
+import os
+import re
+import binascii
+
+# ============================================================
+# IMAP FETCH RESPONSES, BODYSTRUCTURE AND PARTIAL PART FETCHES
+# ============================================================
+# imaplib hands FETCH responses back as raw bytes, with every literal
+# ({n}) split out into a (head, literal) tuple. parse_fetch() turns that
+# into {uid: {"BODYSTRUCTURE": ..., "BODY[...]": ...}}; body_parts() flattens
+# a BODYSTRUCTURE into leaf parts with their IMAP section numbers, so only
+# the parts we want are downloaded, with fetch_part() streaming one part
+# in BODY.PEEK[section]<offset.size> slices and decoding as it goes.
+
+IMAP_PART_CHUNK = int(os.getenv("IMAP_PART_CHUNK", str(1024 * 1024)))   # bytes per partial fetch
+
+_OPEN = object()
+_CLOSE = object()
+
+# ============================================================
+# RESPONSE PARSING
+# ============================================================
+
+def _lex(buf, out):
+    i, n = 0, len(buf)
+    while i < n:
+        c = buf[i:i + 1]
+        if c in b" \r\n":
+            i += 1
+        elif c == b"(":
+            out.append(_OPEN)
+            i += 1
+        elif c == b")":
+            out.append(_CLOSE)
+            i += 1
+        elif c == b'"':
+            j, s = i + 1, bytearray()
+            while j < n and buf[j:j + 1] != b'"':
+                if buf[j:j + 1] == b"\\":
+                    j += 1
+                s += buf[j:j + 1]
+                j += 1
+            out.append(bytes(s))
+            i = j + 1
+        elif c == b"{":
+            # Literal marker: imaplib delivers the literal as the next item
+            i = buf.index(b"}", i) + 1
+        else:
+            # Atom; section specs like BODY[HEADER.FIELDS (FROM DATE)] keep their brackets
+            j, depth = i, 0
+            while j < n:
+                ch = buf[j:j + 1]
+                if ch == b"[":
+                    depth += 1
+                elif ch == b"]":
+                    depth -= 1
+                elif depth == 0 and ch in b" ()\r\n":
+                    break
+                j += 1
+            atom = buf[i:j].decode(errors="replace")
+            out.append(None if atom.upper() == "NIL" else atom)
+            i = j
+
+
+def _tokens(data):
+    tokens = []
+    for item in data:
+        if isinstance(item, tuple):
+            _lex(item[0], tokens)
+            tokens.append(item[1])
+        elif item:
+            _lex(item, tokens)
+    return tokens
+
+
+def _nest(tokens):
+    stack = [[]]
+    for t in tokens:
+        if t is _OPEN:
+            stack.append([])
+        elif t is _CLOSE:
+            done = stack.pop()
+            stack[-1].append(done)
+        else:
+            stack[-1].append(t)
+    return stack[0]
+
+
+def parse_fetch(data):
+    """imaplib UID FETCH response -> {uid: {ITEM_NAME: value}} (item names upper-cased)."""
+    messages = {}
+    for item in _nest(_tokens(data)):
+        if not isinstance(item, list):
+            continue    # message sequence number
+        fields = {str(k).upper(): v for k, v in zip(item[0::2], item[1::2])}
+        if "UID" in fields:
+            messages[int(fields["UID"])] = fields
+    return messages
+
+
+def fetch_item(fields, prefix):
+    """First FETCH item whose name starts with prefix, e.g. 'BODY[HEADER'."""
+    for key, value in fields.items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+# ============================================================
+# BODYSTRUCTURE
+# ============================================================
+
+def _s(value):
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    return str(value)
+
+
+def _params(value):
+    if not isinstance(value, list):
+        return {}
+    return {_s(k).lower(): _s(v) for k, v in zip(value[0::2], value[1::2])}
+
+
+def _is_multipart(node):
+    return bool(node) and isinstance(node[0], list)
+
+
+def _leaf(node, section):
+    ctype = f"{_s(node[0])}/{_s(node[1])}".lower()
+    params = _params(node[2])
+
+    # Extension data starts after the type-specific fields (RFC 3501 7.4.2)
+    if ctype.startswith("text/"):
+        disp_at = 9
+    elif ctype == "message/rfc822":
+        disp_at = 11
+    else:
+        disp_at = 8
+    disposition, disp_params = None, {}
+    if len(node) > disp_at and isinstance(node[disp_at], list) and node[disp_at]:
+        disposition = _s(node[disp_at][0]).lower()
+        disp_params = _params(node[disp_at][1] if len(node[disp_at]) > 1 else None)
+
+    size = _s(node[6])
+    return {
+        "section": section,
+        "type": ctype,
+        "charset": params.get("charset"),
+        "encoding": (_s(node[5]) or "7bit").lower(),
+        "size": int(size) if size and size.isdigit() else 0,
+        "disposition": disposition,
+        "filename": disp_params.get("filename") or params.get("name")
+    }
+
+
+def _walk(node, section):
+    if _is_multipart(node):
+        # Children come first; after the subtype string only extension data follows
+        children = []
+        for c in node:
+            if not isinstance(c, list):
+                break
+            children.append(c)
+        for i, child in enumerate(children, 1):
+            yield from _walk(child, f"{section}.{i}" if section else str(i))
+        return
+
+    part = _leaf(node, section or "1")
+    yield part
+
+    # Forwarded messages: descend like email.Message.walk() does
+    if part["type"] == "message/rfc822" and len(node) > 8 and isinstance(node[8], list):
+        body = node[8]
+        yield from _walk(body, part["section"] if _is_multipart(body) else part["section"] + ".1")
+
+
+def body_parts(bodystructure):
+    """
+    Flatten a parsed BODYSTRUCTURE into leaf parts:
+    {"section", "type", "charset", "encoding", "size", "disposition", "filename"}.
+    """
+    return list(_walk(bodystructure, ""))
+
+# ============================================================
+# STREAMED PART DOWNLOAD
+# ============================================================
+
+class _Base64Decoder:
+    def __init__(self):
+        self.rest = b""
+
+    def feed(self, data):
+        data = self.rest + re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        cut = len(data) - len(data) % 4
+        self.rest = data[cut:]
+        return binascii.a2b_base64(data[:cut]) if cut else b""
+
+    def flush(self):
+        if not self.rest:
+            return b""
+        try:
+            return binascii.a2b_base64(self.rest + b"=" * (-len(self.rest) % 4))
+        except binascii.Error:
+            return b""
+
+
+class _QuotedPrintableDecoder:
+    def __init__(self):
+        self.rest = b""
+
+    def feed(self, data):
+        # Only decode whole lines, so a "=XX" escape is never split
+        data = self.rest + data
+        cut = data.rfind(b"\n") + 1
+        self.rest = data[cut:]
+        return binascii.a2b_qp(data[:cut])
+
+    def flush(self):
+        return binascii.a2b_qp(self.rest)
+
+
+class _IdentityDecoder:
+    def feed(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def _decoder(encoding):
+    if encoding == "base64":
+        return _Base64Decoder()
+    if encoding == "quoted-printable":
+        return _QuotedPrintableDecoder()
+    return _IdentityDecoder()
+
+
+def fetch_part(mail, uid, part, out):
+    """
+    Download one body part in IMAP_PART_CHUNK slices, decode its transfer
+    encoding incrementally and write it to the file object out. PEEK keeps
+    the message unseen. Returns the number of decoded bytes written.
+    """
+    section = part["section"]
+    name = f"BODY[{section}]".encode()
+    decoder = _decoder(part["encoding"])
+    offset, written = 0, 0
+
+    while True:
+        _, data = mail.uid("FETCH", str(uid), f"(BODY.PEEK[{section}]<{offset}.{IMAP_PART_CHUNK}>)")
+        chunk = b""
+        for resp in data or []:
+            if isinstance(resp, tuple) and name in resp[0]:
+                chunk = resp[1]
+                break
+
+        decoded = decoder.feed(chunk)
+        out.write(decoded)
+        written += len(decoded)
+        offset += len(chunk)
+        if len(chunk) < IMAP_PART_CHUNK:
+            break
+
+    tail = decoder.flush()
+    out.write(tail)
+    return written + len(tail)
+
+
+def decode_text(raw, charset):
+    try:
+        return raw.decode(charset or "utf-8", errors="ignore")
+    except LookupError:
+        return raw.decode("utf-8", errors="ignore")
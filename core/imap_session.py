@@ -0,0 +1,137 @@
+import os
+import ssl
+import imaplib
+import select
+import time
+
+# ============================================================
+# LONG-LIVED IMAP SESSION WITH IDLE
+# ============================================================
+# One TLS login per connection instead of one per poll. When the server
+# advertises IDLE (RFC 2177) the session blocks until the server pushes
+# an untagged response (new mail); otherwise it sleeps and sends NOOP,
+# which still reports new messages without logging in again.
+# imaplib has no IDLE support before Python 3.14, so it is spoken here
+# directly on imaplib's socket.
+
+IDLE_RENEW = 300          # seconds; RFC 2177 asks clients to re-issue IDLE within 29 min
+# Socket timeout: a connection dropped by a NAT/firewall fails a read in
+# this long instead of hanging until TCP gives up (~15 min), so run() reconnects
+IMAP_TIMEOUT = float(os.getenv("IMAP_TIMEOUT", "60"))   # seconds
+
+
+class MailboxSession:
+
+    def __init__(self, server, user, password, mailbox="INBOX"):
+        self.server = server
+        self.user = user
+        self.password = password
+        self.mailbox = mailbox
+        self.conn = None
+        self.has_idle = False
+        self.uidvalidity = None
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        self.conn = imaplib.IMAP4_SSL(self.server, timeout=IMAP_TIMEOUT)
+        self.conn.login(self.user, self.password)
+        status, _ = self.conn.select(self.mailbox)
+        if status != "OK":
+            raise imaplib.IMAP4.error(f"Cannot select {self.mailbox}")
+        _, data = self.conn.response("UIDVALIDITY")
+        self.uidvalidity = int(data[0]) if data and data[0] else 0
+        self.has_idle = "IDLE" in self.conn.capabilities
+
+    def close(self):
+        if self.conn is None:
+            return
+        try:
+            self.conn.logout()
+        except Exception:
+            pass
+        self.conn = None
+
+    def _buffered(self):
+        """
+        True if a response is already off the socket: imaplib reads through
+        a BufferedReader (and TLS may hold a decrypted record), so a
+        '* n EXISTS' that came in the same read as '+ idling' is invisible
+        to select(). A non-blocking peek returns that data, or pulls in
+        whatever the socket has, without ever waiting.
+        """
+        sock = self.conn.sock
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            return bool(self.conn.file.peek(1))
+        except (ssl.SSLWantReadError, BlockingIOError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def _readable(self, timeout):
+        if self._buffered():
+            return True
+        ready, _, _ = select.select([self.conn.sock], [], [], timeout)
+        return bool(ready)
+
+    def idle(self, timeout=IDLE_RENEW, stop_event=None):
+        """
+        Block until the server reports mailbox activity or timeout passes.
+        Returns True if something was pushed. Raises on a dead connection,
+        so the caller can reconnect.
+        """
+        tag = self.conn._new_tag()
+        self.conn.send(tag + b" IDLE\r\n")
+        line = self.conn.readline()
+        if not line.startswith(b"+"):
+            raise imaplib.IMAP4.abort(f"IDLE rejected: {line!r}")
+
+        pushed = False
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                break
+            if not self._readable(max(0.0, min(1.0, deadline - time.monotonic()))):
+                continue
+            line = self.conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed during IDLE")
+            # Any untagged data except a keep-alive "* OK" ends the wait
+            # (EXISTS, RECENT, EXPUNGE...); a spurious wake only costs one SEARCH
+            pushed = not line.startswith(b"* OK")
+            if pushed:
+                break
+
+        # Leave IDLE and consume everything up to its tagged completion
+        self.conn.send(b"DONE\r\n")
+        while True:
+            line = self.conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("Connection closed leaving IDLE")
+            if line.startswith(tag):
+                self.conn.tagged_commands.pop(tag, None)
+                if b" OK" not in line:
+                    raise imaplib.IMAP4.abort(f"IDLE failed: {line!r}")
+                break
+            pushed = pushed or line.startswith(b"* ")
+        return pushed
+
+    def wait(self, poll_interval, stop_event=None):
+        """IDLE if the server supports it, otherwise sleep then NOOP (keeps the login alive)."""
+        if self.has_idle:
+            return self.idle(stop_event=stop_event)
+
+        deadline = time.monotonic() + poll_interval
+        while time.monotonic() < deadline:
+            if stop_event is not None and stop_event.is_set():
+                return False
+            time.sleep(max(0.0, min(1.0, deadline - time.monotonic())))
+        self.conn.noop()
+        return True
@@ -0,0 +1,87 @@
+from core.db_pool import get_connection, ensure_tables
+
+# ============================================================
+# INGESTION DEDUPLICATION INDEX
+# ============================================================
+# The same PO often arrives more than once: forwarded, CC'd to a second
+# address, or simply resent. Ingestion checks two indexes before anything
+# reaches incoming/ (and so before OCR, the LLM and the agent run):
+#   - ingested_messages: Message-ID of every message already ingested
+#   - ingested_files:    sha256 of every attachment / email-body PO, with
+#                        the file it was registered under
+# A copy only counts as a duplicate while the first file is still alive
+# in po_manifest: once that one failed, a resend is ingested afresh.
+
+# ============================================================
+# MESSAGES
+# ============================================================
+
+def message_seen(message_id):
+    if not message_id:
+        return False
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT 1 FROM ingested_messages WHERE message_id = %s", (message_id,))
+        return cur.fetchone() is not None
+
+
+def record_message(message_id, from_email=None):
+    """Called once a message is fully ingested, so a crash midway re-ingests it."""
+    if not message_id:
+        return
+    ensure_tables()
+    with get_connection() as conn:
+        conn.cursor().execute("""
+            INSERT INTO ingested_messages (message_id, from_email)
+            VALUES (%s, %s)
+            ON CONFLICT (message_id) DO NOTHING
+        """, (message_id, from_email))
+
+# ============================================================
+# FILE CONTENT
+# ============================================================
+
+def claim_file(sha256, file_name, message_id=None):
+    """
+    Register content under file_name. Returns None if it is new (or its
+    earlier copy failed / never reached the manifest), otherwise the file
+    name the same bytes were first ingested as (and counts the copy).
+    """
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO ingested_files (sha256, file_name, message_id)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (sha256) DO NOTHING
+        """, (sha256, file_name, message_id))
+        if cur.rowcount == 1:
+            return None
+
+        cur.execute("""
+            UPDATE ingested_files f
+            SET file_name = %s, message_id = %s, duplicates = 0, created_at = CURRENT_TIMESTAMP
+            WHERE f.sha256 = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM po_manifest m
+                  WHERE m.file_name = f.file_name AND m.status <> 'failed'
+              )
+        """, (file_name, message_id, sha256))
+        if cur.rowcount == 1:
+            return None
+
+        cur.execute("""
+            UPDATE ingested_files SET duplicates = duplicates + 1
+            WHERE sha256 = %s
+            RETURNING file_name
+        """, (sha256,))
+        row = cur.fetchone()
+    return row[0] if row else None
+
+
+def release_file(sha256):
+    """Undo claim_file() when the file could not be registered after all."""
+    ensure_tables()
+    with get_connection() as conn:
+        conn.cursor().execute("DELETE FROM ingested_files WHERE sha256 = %s", (sha256,))
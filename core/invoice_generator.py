@@ -1,9 +1,8 @@
 
 import os
 import json
-import psycopg2
 from datetime import datetime
-from config.db_config import DB_CONFIG
+from core.db_pool import get_connection
 
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
@@ -19,21 +18,24 @@ from reportlab.lib.enums import TA_CENTER
 # 1. DATABASE CONFIG
 # ============================================================
 
-def db_connect():
-    return psycopg2.connect(**DB_CONFIG)
-
 def get_product_data(product_id):
     """Fetch unit price and name from inventory table."""
-    conn = db_connect()
-    cur = conn.cursor()
+    return get_product_data_batch([product_id])[product_id]
+
+def get_product_data_batch(product_ids):
+    """Fetch unit price and name for every invoice line in one query."""
+    unknown = {"price": 0.0, "name": "Unknown Product"}
+    ids = list(dict.fromkeys(pid for pid in product_ids if pid))
 
-    cur.execute("SELECT price, product_name FROM inventory WHERE product_id = %s", (product_id,))
-    row = cur.fetchone()
+    rows = []
+    if ids:
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT product_id, price, product_name FROM inventory WHERE product_id = ANY(%s)", (ids,))
+            rows = cur.fetchall()
 
-    conn.close()
-    if row:
-        return {"price": float(row[0]), "name": row[1]}
-    return {"price": 0.0, "name": "Unknown Product"}
+    found = {r[0]: {"price": float(r[1] or 0), "name": r[2]} for r in rows}
+    return {pid: found.get(pid, dict(unknown)) for pid in product_ids}
 
 # ============================================================
 # 2. COMPANY DETAILS LOADER
@@ -126,10 +128,12 @@ class InvoiceGenerator:
         table_data = [["Description", "Qty", "Unit Price", "Amount"]]
         subtotal = 0
 
+        # If price/name missing in PO, fetch from DB (one lookup for all lines)
+        product_data = get_product_data_batch([it.get("product_id") for it in items])
+
         for it in items:
             product_id = it.get("product_id")
-            # If price/name missing in PO, fetch from DB
-            db_data = get_product_data(product_id)
+            db_data = product_data[product_id]
             
             desc = it.get("description") or db_data["name"]
             price = float(it.get("unit_price") or db_data["price"])
@@ -0,0 +1,143 @@
+import os
+import json
+from core.db_pool import get_connection, ensure_tables
+from core.pg_notify import notify
+
+# ============================================================
+# CONFIG
+# ============================================================
+
+MAX_ATTEMPTS = int(os.getenv("AGENT_JOB_MAX_ATTEMPTS", "3"))
+RETRY_BACKOFF = int(os.getenv("AGENT_JOB_RETRY_BACKOFF", "30"))   # seconds, x attempts
+JOB_TIMEOUT = int(os.getenv("AGENT_JOB_TIMEOUT", "900"))           # seconds before a running job is reclaimed
+
+JOB_PROCESS_PO = "process_po"
+JOB_PARTIAL_RESPONSE = "partial_response"
+JOB_CUSTOMER_REPLY = "customer_reply"     # routed by the mailbox service, drained by services/reply_listener.py
+
+# NOTIFY channel that wakes services/agent_worker_service.py
+AGENT_JOBS_CHANNEL = "agent_jobs"
+
+# ============================================================
+# PRODUCER
+# ============================================================
+
+def enqueue_job(cur, job_type, po_id, payload=None):
+    """
+    Queue a job on the caller's cursor, so it commits (or rolls back)
+    together with the rows that produced it. The NOTIFY is delivered to
+    listening workers at that same commit.
+    """
+    cur.execute("""
+        INSERT INTO agent_jobs (job_type, po_id, payload)
+        VALUES (%s, %s, %s)
+        RETURNING job_id
+    """, (job_type, po_id, json.dumps(payload) if payload is not None else None))
+    job_id = cur.fetchone()[0]
+    notify(cur, AGENT_JOBS_CHANNEL, job_id)
+    return job_id
+
+
+def submit_job(job_type, po_id, payload=None):
+    """Queue a job in its own transaction (for callers with no open cursor)."""
+    ensure_tables()
+    with get_connection() as conn:
+        return enqueue_job(conn.cursor(), job_type, po_id, payload)
+
+# ============================================================
+# CONSUMER
+# ============================================================
+
+def claim_job(job_types=None):
+    """
+    Atomically claim the oldest ready job (of one of job_types, if given).
+    SKIP LOCKED lets any number of workers poll the same table without
+    blocking on each other. Returns a dict or None when the queue is empty.
+    """
+    types = list(job_types) if job_types else None
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE agent_jobs
+            SET status = 'running', attempts = attempts + 1,
+                locked_at = NOW(), updated_at = NOW()
+            WHERE job_id = (
+                SELECT job_id FROM agent_jobs
+                WHERE status = 'queued' AND run_after <= NOW()
+                  AND (%s::text[] IS NULL OR job_type = ANY(%s::text[]))
+                ORDER BY job_id
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING job_id, job_type, po_id, payload, attempts
+        """, (types, types))
+        row = cur.fetchone()
+
+    if not row:
+        return None
+
+    return {
+        "job_id": row[0],
+        "job_type": row[1],
+        "po_id": row[2],
+        "payload": json.loads(row[3]) if row[3] else {},
+        "attempts": row[4]
+    }
+
+
+def complete_job(job_id):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE agent_jobs SET status = 'done', locked_at = NULL, updated_at = NOW()
+            WHERE job_id = %s
+        """, (job_id,))
+
+
+def hold_job(job_id, reason):
+    """Park a job for a human: status 'needs_review', never retried automatically."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE agent_jobs
+            SET status = 'needs_review', last_error = %s, locked_at = NULL, updated_at = NOW()
+            WHERE job_id = %s
+        """, (reason, job_id))
+
+
+def fail_job(job, error):
+    """Requeue with linear backoff, or park as 'failed' after MAX_ATTEMPTS."""
+    final = job["attempts"] >= MAX_ATTEMPTS
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE agent_jobs
+            SET status = %s, last_error = %s, locked_at = NULL, updated_at = NOW(),
+                run_after = NOW() + make_interval(secs => %s)
+            WHERE job_id = %s
+        """, (
+            "failed" if final else "queued",
+            str(error),
+            RETRY_BACKOFF * job["attempts"],
+            job["job_id"]
+        ))
+    return final
+
+
+def requeue_stale_jobs():
+    """
+    Return jobs held by a crashed worker to the queue. attempts was counted
+    at claim time, so a job that keeps killing its worker is parked as
+    'failed' after MAX_ATTEMPTS instead of looping forever.
+    """
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE agent_jobs
+            SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                last_error = 'Worker lost the job (timed out while running)',
+                locked_at = NULL, updated_at = NOW()
+            WHERE status = 'running'
+              AND locked_at < NOW() - make_interval(secs => %s)
+        """, (MAX_ATTEMPTS, JOB_TIMEOUT))
+        return cur.rowcount
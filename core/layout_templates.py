@@ -0,0 +1,321 @@
+import os
+import json
+from email.utils import parseaddr
+
+from core.db_pool import get_connection, ensure_tables
+from core import rule_parser
+from core.po_schema import empty_po, to_number, normalize_date
+
+# ============================================================
+# PER-SENDER LAYOUT TEMPLATES
+# ============================================================
+# Repeat buyers send the same PO layout every time. After a successful
+# extraction we record, per sender, which label sits next to each header
+# value ("PO No:" -> po_number), which table headers hold the line item
+# columns, and the buyer / seller details that don't change between
+# orders. The next digital PO from that sender is read straight from the
+# PDF's words with those anchors: no OCR, no LLM.
+
+TEMPLATES_ENABLED = os.getenv("LAYOUT_TEMPLATES", "1") == "1"
+TEMPLATE_MIN_CONFIDENCE = float(os.getenv("TEMPLATE_MIN_CONFIDENCE", "0.8"))
+
+# Shared mailbox providers: key on the full address, not the domain
+FREE_MAIL_DOMAINS = {
+    "gmail.com", "googlemail.com", "yahoo.com", "yahoo.co.in", "outlook.com",
+    "hotmail.com", "live.com", "icloud.com", "rediffmail.com", "protonmail.com"
+}
+
+ANCHORED_FIELDS = ("po_number", "po_date", "total_amount")
+ITEM_FIELDS = ("product_id", "product_identifier_raw", "description", "unit", "quantity", "unit_price", "line_total")
+STATIC_FIELDS = ("buyer", "seller", "currency")
+
+LINE_TOLERANCE = 3      # points; words this close vertically share a line
+LABEL_GAP = 40          # points; a wider gap ends the label to the left of a value
+MAX_LABEL_WORDS = 3
+MAX_VALUE_WORDS = 4
+
+def sender_key(from_email):
+    """'Buyer <po@acme.com>' -> 'acme.com' (full address for free-mail senders)."""
+    addr = parseaddr(from_email or "")[1].lower()
+    if "@" not in addr:
+        return None
+    domain = addr.rsplit("@", 1)[1]
+    return addr if domain in FREE_MAIL_DOMAINS else domain
+
+# ============================================================
+# STORE
+# ============================================================
+
+def get_template(key):
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT template FROM layout_templates WHERE sender_key = %s", (key,))
+        row = cur.fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def save_template(key, template):
+    ensure_tables()
+    with get_connection() as conn:
+        conn.cursor().execute("""
+            INSERT INTO layout_templates (sender_key, template)
+            VALUES (%s, %s)
+            ON CONFLICT (sender_key) DO UPDATE
+            SET template = EXCLUDED.template,
+                samples = layout_templates.samples + 1,
+                updated_at = CURRENT_TIMESTAMP
+        """, (key, json.dumps(template)))
+
+# ============================================================
+# WORD GEOMETRY
+# ============================================================
+
+def _lines(words):
+    """Group one page's words into lines, top to bottom, left to right."""
+    lines = []
+    for w in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(lines[-1][0]["top"] - w["top"]) <= LINE_TOLERANCE:
+            lines[-1].append(w)
+        else:
+            lines.append([w])
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def _text(words):
+    return " ".join(w["text"] for w in words)
+
+
+def _has_digit(word):
+    return any(c.isdigit() for c in word["text"])
+
+
+def _normalize(field, text):
+    if field == "po_date":
+        return normalize_date(text) if any(c.isdigit() for c in text) else ""
+    if field == "total_amount":
+        return to_number(text)
+    return text.strip(" :#")
+
+
+def _same(field, found, expected):
+    if field in ("total_amount", "quantity", "unit_price", "line_total"):
+        try:
+            return abs(float(found) - float(expected)) < 0.005
+        except ValueError:
+            return False
+    return bool(found) and found.lower() == str(expected).strip().lower()
+
+
+def _label_left_of(line, start):
+    """The label words directly left of line[start] (no digits, no wide gaps)."""
+    label = []
+    x = line[start]["x0"]
+    for w in reversed(line[:start]):
+        if x - w["x1"] > LABEL_GAP or _has_digit(w):
+            break
+        label.insert(0, w)
+        x = w["x0"]
+        if len(label) == MAX_LABEL_WORDS:
+            break
+    return label
+
+
+def _label_above(lines, li, value_words):
+    if li == 0:
+        return []
+    x0, x1 = value_words[0]["x0"], value_words[-1]["x1"]
+    return [
+        w for w in lines[li - 1]
+        if w["x1"] > x0 - 5 and w["x0"] < x1 + 5 and not _has_digit(w)
+    ][:MAX_LABEL_WORDS]
+
+# ============================================================
+# LEARN
+# ============================================================
+
+def _learn_field(pages, field, expected):
+    """Where a known header value sits: the label next to it and its width in words."""
+    for page_no, lines in enumerate(pages):
+        for li, line in enumerate(lines):
+            for start in range(len(line)):
+                for n in range(1, min(MAX_VALUE_WORDS, len(line) - start) + 1):
+                    value_words = line[start:start + n]
+                    if field != "po_number" and not (_has_digit(value_words[0]) and _has_digit(value_words[-1])):
+                        # Keep label words like 'Total' out of numeric / date values
+                        continue
+                    if not _same(field, _normalize(field, _text(value_words)), expected):
+                        continue
+                    label = _label_left_of(line, start)
+                    if label:
+                        return {"page": page_no, "anchor": _text(label).lower(), "direction": "right", "words": n}
+                    label = _label_above(lines, li, value_words)
+                    if label:
+                        return {"page": page_no, "anchor": _text(label).lower(), "direction": "below", "words": n}
+    return None
+
+
+def _cell(value):
+    return " ".join(str(value or "").split())
+
+
+def _learn_columns(tables, items):
+    """Header label of each line item column, from the table holding the first item."""
+    first = items[0]
+    for table in tables:
+        for r, row in enumerate(table):
+            cells = [_cell(c) for c in row]
+            desc = first.get("description", "").lower()
+            if r == 0 or not desc or not any(desc == c.lower() for c in cells):
+                continue
+
+            header = [_cell(c).lower() for c in table[r - 1]]
+            columns, indices = {}, {}
+            for field in ITEM_FIELDS:
+                expected = str(first.get(field, "") or "")
+                if not expected:
+                    continue
+                for col, c in enumerate(cells):
+                    found = to_number(c) if field in ("quantity", "unit_price", "line_total") else c
+                    if col < len(header) and header[col] and header[col] not in columns.values() and _same(field, found, expected):
+                        columns[field] = header[col]
+                        indices[field] = col
+                        break
+
+            if "description" in columns and "quantity" in columns:
+                return {"columns": columns, "indices": indices, "width": len(row)}
+    return None
+
+
+def build_template(layout, data):
+    """Template for this layout, or None if the extraction can't be located in it."""
+    if not data.get("line_items"):
+        return None
+
+    pages = [_lines(words) for words in layout["words"]]
+    fields = {}
+    for field in ANCHORED_FIELDS:
+        if data.get(field):
+            spec = _learn_field(pages, field, data[field])
+            if spec:
+                fields[field] = spec
+
+    table = _learn_columns(layout["tables"], data["line_items"])
+    if "po_number" not in fields or not table:
+        return None
+
+    return {
+        "fields": fields,
+        "table": table,
+        "static": {k: data.get(k) for k in STATIC_FIELDS}
+    }
+
+
+def _same_item(found, expected):
+    """The fields the agent acts on: product id (stock) and line total (invoice)."""
+    if not expected.get("product_id") or not _same("product_id", found["product_id"], expected["product_id"]):
+        return False
+    if expected.get("line_total"):
+        return _same("line_total", found["line_total"], expected["line_total"])
+    return True
+
+
+def learn(from_email, layout, data):
+    """
+    Record (or refresh) the sender's template from a successful extraction.
+    Only stored if applying it to the same PDF reproduces the extraction.
+    """
+    key = sender_key(from_email)
+    if not key or layout is None:
+        return False
+
+    template = build_template(layout, data)
+    if not template:
+        return False
+
+    check = apply_template(layout, template)
+    if (check["po_number"] != data.get("po_number")
+            or len(check["line_items"]) != len(data["line_items"])
+            or not all(_same_item(found, expected) for found, expected in zip(check["line_items"], data["line_items"]))):
+        return False
+
+    save_template(key, template)
+    print(f"📐 Layout template learned for {key}")
+    return True
+
+# ============================================================
+# APPLY
+# ============================================================
+
+def _apply_field(pages, field, spec):
+    anchor = spec["anchor"].split()
+    # Pages other than the learned one are a fallback for longer POs
+    order = [spec["page"]] + [p for p in range(len(pages)) if p != spec["page"]]
+    for page_no in order:
+        if page_no >= len(pages):
+            continue
+        lines = pages[page_no]
+        for li, line in enumerate(lines):
+            texts = [w["text"].lower() for w in line]
+            for i in range(len(texts) - len(anchor) + 1):
+                if texts[i:i + len(anchor)] != anchor:
+                    continue
+                if spec["direction"] == "right":
+                    value_words = line[i + len(anchor):i + len(anchor) + spec["words"]]
+                elif li + 1 < len(lines):
+                    x0, x1 = line[i]["x0"], line[i + len(anchor) - 1]["x1"]
+                    value_words = [w for w in lines[li + 1] if w["x1"] > x0 - 5 and w["x0"] < x1 + 5][:spec["words"]]
+                else:
+                    value_words = []
+                value = _normalize(field, _text(value_words))
+                if value:
+                    return value
+    return ""
+
+
+def _apply_table(tables, spec):
+    items = []
+    for table in tables:
+        mapping = None
+        for h, row in enumerate(table[:3]):
+            header = [_cell(c).lower() for c in row]
+            found = {f: header.index(label) for f, label in spec["columns"].items() if label in header}
+            if "description" in found and "quantity" in found:
+                mapping, body = found, table[h + 1:]
+                break
+
+        if mapping is None and table and len(table[0]) == spec["width"]:
+            # Continuation of the item table on a later page (no header row)
+            mapping, body = spec["indices"], table
+
+        if mapping:
+            items.extend(rule_parser.rows_to_items(body, mapping))
+    return items
+
+
+def apply_template(layout, template):
+    data = empty_po()
+    pages = [_lines(words) for words in layout["words"]]
+    for field, spec in template["fields"].items():
+        data[field] = _apply_field(pages, field, spec)
+
+    for k, v in template["static"].items():
+        if v:
+            data[k] = v
+
+    data["line_items"] = _apply_table(layout["tables"], template["table"])
+    return data
+
+
+def extract(from_email, layout):
+    """(extracted_data, confidence) from the sender's template, or (None, 0.0)."""
+    key = sender_key(from_email)
+    if not key or layout is None:
+        return None, 0.0
+
+    template = get_template(key)
+    if not template:
+        return None, 0.0
+
+    data = apply_template(layout, template)
+    return data, rule_parser.score(data)
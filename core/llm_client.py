@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ============================================================
+# SHARED OLLAMA CLIENT
+# ============================================================
+# - one keep-alive HTTP session per process (no TCP setup per call)
+# - streaming: tokens are consumed as they arrive, and JSON extraction
+#   can hang up as soon as the top-level object is closed
+# - a semaphore caps in-flight requests from this process so OCR and
+#   agent workers can't pile onto the single Ollama instance
+# - per-call latency / token metrics
+
+OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
+CONNECT_TIMEOUT = 5   # seconds
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(LLM_MAX_CONCURRENCY)
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "calls": 0,
+    "errors": 0,
+    "early_stops": 0,
+    "total_latency": 0.0,
+    "prompt_tokens": 0,
+    "completion_tokens": 0
+}
+
+
+def _get_session():
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        with _session_lock:
+            if _session is None or _session_pid != os.getpid():
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=LLM_MAX_CONCURRENCY)
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _session = s
+                _session_pid = os.getpid()
+    return _session
+
+
+class _JsonEndDetector:
+    """Tracks brace depth (ignoring braces inside strings) across streamed chunks."""
+
+    def __init__(self):
+        self.depth = 0
+        self.started = False
+        self.in_string = False
+        self.escape = False
+
+    def feed(self, chunk):
+        for ch in chunk:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.started:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+                self.started = True
+            elif ch == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    return True
+        return False
+
+
+def generate(prompt, model, options=None, timeout=120, stop_at_json=False, response_format=None, url=None):
+    """
+    Stream a completion from Ollama and return the full response text.
+
+    stop_at_json: stop reading (and let Ollama abort generation) as soon as
+    the first top-level JSON object is complete.
+    response_format: sent as Ollama's "format" ("json" or a JSON schema dict).
+    timeout: total seconds for the whole call, not per read.
+    """
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    if options:
+        payload["options"] = options
+    if response_format is not None:
+        payload["format"] = response_format
+
+    detector = _JsonEndDetector() if stop_at_json else None
+    parts = []
+    final = {}
+    early = False
+
+    with _slots:
+        start = time.monotonic()
+        first_token_at = None
+        try:
+            with _get_session().post(url or OLLAMA_URL, json=payload, stream=True,
+                                     timeout=(CONNECT_TIMEOUT, timeout)) as resp:
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise RuntimeError(f"Ollama error: {chunk['error']}")
+
+                    piece = chunk.get("response", "")
+                    if piece:
+                        if first_token_at is None:
+                            first_token_at = time.monotonic()
+                        parts.append(piece)
+
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+                    if detector is not None and detector.feed(piece):
+                        early = True
+                        break
+                    if time.monotonic() - start > timeout:
+                        raise requests.Timeout(f"LLM call exceeded {timeout}s")
+        except Exception:
+            with _metrics_lock:
+                _metrics["calls"] += 1
+                _metrics["errors"] += 1
+            raise
+
+    latency = time.monotonic() - start
+    # Ollama only reports token counts in the final chunk; after an early
+    # stop each streamed chunk is one token
+    completion_tokens = final.get("eval_count", len(parts))
+    prompt_tokens = final.get("prompt_eval_count", 0)
+
+    with _metrics_lock:
+        _metrics["calls"] += 1
+        _metrics["early_stops"] += int(early)
+        _metrics["total_latency"] += latency
+        _metrics["prompt_tokens"] += prompt_tokens
+        _metrics["completion_tokens"] += completion_tokens
+
+    ttft = (first_token_at - start) if first_token_at else latency
+    print(
+        f"🧠 LLM {model}: {latency:.2f}s (first token {ttft:.2f}s), "
+        f"{prompt_tokens} prompt + {completion_tokens} completion tokens"
+        f"{', stopped at closing brace' if early else ''}"
+    )
+    return "".join(parts)
+
+
+def get_metrics():
+    """Snapshot of this process's LLM call metrics."""
+    with _metrics_lock:
+        m = dict(_metrics)
+    ok_calls = m["calls"] - m["errors"]
+    m["avg_latency"] = m["total_latency"] / ok_calls if ok_calls else 0.0
+    return m
@@ -0,0 +1,103 @@
+import os
+import re
+from email.header import decode_header, make_header
+from email.utils import make_msgid, parseaddr
+
+from core.db_pool import get_connection
+
+# ============================================================
+# MAILBOX ROUTING
+# ============================================================
+# One service reads the INBOX and decides, from headers and BODYSTRUCTURE, whether a
+# message answers a partial-stock proposal (-> customer_reply job for the
+# reply listener) or is ingested as a possible new PO. Emails the agent
+# sends carry a Message-ID tagged with the PO id, so replies are matched
+# through In-Reply-To / References; clients that drop those headers fall
+# back to a "Re:" subject naming (or coming from the sender of) a PO that
+# is WAITING_FOR_REPLY. Buyers often send a new order by replying to an
+# old thread, so a message carrying a PO attachment is only treated as a
+# reply when its headers reference a waiting PO.
+
+ROUTE_REPLY = "reply"
+ROUTE_PO = "po"
+
+PO_MSGID_RE = re.compile(r"\.po-(\d+)@")
+REPLY_SUBJECT_RE = re.compile(r"^\s*(re|aw|sv)\s*:", re.IGNORECASE)
+
+
+def po_message_id(po_id):
+    """Message-ID for an outgoing email about po_id; replies quote it back."""
+    sender = os.getenv("EMAIL_USER") or ""
+    domain = sender.rsplit("@", 1)[1] if "@" in sender else None
+    return make_msgid(idstring=f"po-{po_id}", domain=domain)
+
+
+def header_text(value):
+    """RFC 2047 encoded header -> str."""
+    if not value:
+        return ""
+    try:
+        return str(make_header(decode_header(value)))
+    except Exception:
+        return str(value)
+
+
+def _waiting_pos():
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT po_id, po_number, sender_email FROM purchase_orders
+            WHERE status = 'WAITING_FOR_REPLY'
+            ORDER BY po_id DESC
+        """)
+        return cur.fetchall()
+
+
+def _names_po(subject, po_number):
+    return bool(po_number) and re.search(rf"(?<!\w){re.escape(po_number)}(?!\w)", subject, re.IGNORECASE) is not None
+
+
+def reply_po_id(headers, has_attachment=False):
+    """
+    po_id of the WAITING_FOR_REPLY PO this message answers, or None.
+    Ordinary mail (no PO reference, no "Re:") never touches the database.
+    """
+    subject = header_text(headers.get("Subject"))
+    refs = f"{headers.get('In-Reply-To') or ''} {headers.get('References') or ''}"
+    referenced = {int(x) for x in PO_MSGID_RE.findall(refs)}
+    is_reply_subject = REPLY_SUBJECT_RE.match(subject) is not None
+
+    if not referenced and not is_reply_subject:
+        return None
+
+    waiting = _waiting_pos()
+    if referenced:
+        # The headers say which PO this answers: trust them either way, so a
+        # reply about a completed PO never lands on another waiting one
+        return next((po_id for po_id, _, _ in waiting if po_id in referenced), None)
+
+    if has_attachment:
+        return None
+
+    sender = parseaddr(headers.get("From") or "")[1].lower()
+    named = [po for po in waiting if _names_po(subject, po[1])]
+    from_sender = [po for po in waiting if sender and (po[2] or "").lower() == sender]
+
+    for group in ([po for po in named if po in from_sender], named):
+        if group:
+            return group[0][0]
+    # Subject names no PO: only unambiguous if the sender has a single one waiting
+    if len(from_sender) == 1:
+        return from_sender[0][0]
+    return None
+
+
+def classify(headers, has_attachment=False):
+    """
+    (ROUTE_REPLY, po_id) for proposal replies, else (ROUTE_PO, None).
+    has_attachment: the message carries a file ingestion would accept.
+    """
+    po_id = reply_po_id(headers, has_attachment)
+    if po_id:
+        return ROUTE_REPLY, po_id
+    return ROUTE_PO, None
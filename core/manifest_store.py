@@ -0,0 +1,221 @@
+import os
+import json
+from psycopg2.extras import execute_values
+
+from core.db_pool import get_connection, ensure_tables
+from core.pg_notify import notify
+
+# ============================================================
+# MANIFEST STORE (replaces manifest.json)
+# ============================================================
+# One row per ingested file. Status moves pending -> processing ->
+# processed | failed through single conditional UPDATEs, so any number
+# of ingestion / OCR processes can share it without losing updates.
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEGACY_MANIFEST = os.path.join(BASE_DIR, "manifest.json")
+
+# NOTIFY channel that wakes the OCR service when a file is registered
+MANIFEST_CHANNEL = "po_manifest"
+
+def _row_to_entry(row):
+    return {
+        "file_name": row[0],
+        "status": row[1],
+        "email_metadata": json.loads(row[2]) if row[2] else {},
+        "json": row[3],
+        "error": row[4]
+    }
+
+_ENTRY_COLUMNS = "file_name, status, email_metadata, json_name, error"
+
+# ============================================================
+# WRITERS
+# ============================================================
+
+def add_entry(file_name, email_metadata=None, status="pending"):
+    """Register a new file. Returns False if the name is already known."""
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO po_manifest (file_name, status, email_metadata)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (file_name) DO NOTHING
+        """, (file_name, status, json.dumps(email_metadata or {})))
+        added = cur.rowcount == 1
+        if added and status == "pending":
+            notify(cur, MANIFEST_CHANNEL, file_name)
+    return added
+
+
+def claim_entry(file_name):
+    """
+    Atomically move one entry pending -> processing.
+    Returns the entry, or None if it is unknown or another worker has it.
+    """
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE po_manifest SET status = 'processing', updated_at = NOW()
+            WHERE file_name = %s AND status = 'pending'
+            RETURNING {_ENTRY_COLUMNS}
+        """, (file_name,))
+        row = cur.fetchone()
+    return _row_to_entry(row) if row else None
+
+
+def claim_next_pending():
+    """
+    Atomically claim the oldest pending entry. SKIP LOCKED lets every OCR
+    worker process call this concurrently without blocking or double-claiming.
+    """
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            UPDATE po_manifest SET status = 'processing', updated_at = NOW()
+            WHERE file_name = (
+                SELECT file_name FROM po_manifest
+                WHERE status = 'pending'
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING {_ENTRY_COLUMNS}
+        """)
+        row = cur.fetchone()
+    return _row_to_entry(row) if row else None
+
+
+def touch_claim(file_name):
+    """Heartbeat from the worker processing file_name, so its claim never looks stale."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE po_manifest SET updated_at = NOW()
+            WHERE file_name = %s AND status = 'processing'
+        """, (file_name,))
+
+
+def release_stale_claims(timeout_seconds):
+    """
+    Return entries whose 'processing' claim has had no heartbeat for
+    timeout_seconds (their worker died) to 'pending'. Returns the released
+    file names so the caller can move the files back to incoming/.
+    """
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE po_manifest SET status = 'pending', updated_at = NOW()
+            WHERE status = 'processing'
+              AND updated_at < NOW() - make_interval(secs => %s)
+            RETURNING file_name
+        """, (timeout_seconds,))
+        return [r[0] for r in cur.fetchall()]
+
+
+def mark_processed(file_name, json_name):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE po_manifest
+            SET status = 'processed', json_name = %s, error = NULL, updated_at = NOW()
+            WHERE file_name = %s
+        """, (json_name, file_name))
+
+
+def mark_failed(file_name, error):
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE po_manifest
+            SET status = 'failed', error = %s, updated_at = NOW()
+            WHERE file_name = %s
+        """, (str(error), file_name))
+
+# ============================================================
+# READERS
+# ============================================================
+
+def get_entry(file_name):
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {_ENTRY_COLUMNS} FROM po_manifest WHERE file_name = %s", (file_name,))
+        row = cur.fetchone()
+    return _row_to_entry(row) if row else None
+
+
+def list_pending(limit=100):
+    """Oldest-first pending file names (served by the partial status index)."""
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT file_name FROM po_manifest
+            WHERE status = 'pending'
+            ORDER BY created_at
+            LIMIT %s
+        """, (limit,))
+        return [r[0] for r in cur.fetchall()]
+
+
+def get_recent_entries(limit=50):
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT {_ENTRY_COLUMNS} FROM po_manifest
+            ORDER BY created_at DESC
+            LIMIT %s
+        """, (limit,))
+        return [_row_to_entry(r) for r in cur.fetchall()]
+
+# ============================================================
+# ONE-TIME MIGRATION FROM manifest.json
+# ============================================================
+
+def migrate_from_json(path=LEGACY_MANIFEST):
+    """
+    Import entries from the old manifest.json. Idempotent: names already in
+    the store are left untouched, so it is safe to run on every start.
+    Returns the number of entries imported.
+    """
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return 0
+
+    if not isinstance(manifest, dict) or not manifest:
+        return 0
+
+    rows = []
+    for file_name, v in manifest.items():
+        metadata = v.get("email_metadata") or {}
+        # Oldest entries kept received_at at the top level
+        if not metadata and v.get("received_at"):
+            metadata = {"received_at": v["received_at"]}
+        rows.append((
+            file_name,
+            v.get("status", "pending"),
+            json.dumps(metadata),
+            v.get("json"),
+            v.get("error")
+        ))
+
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        inserted = execute_values(cur, """
+            INSERT INTO po_manifest (file_name, status, email_metadata, json_name, error)
+            VALUES %s
+            ON CONFLICT (file_name) DO NOTHING
+            RETURNING file_name
+        """, rows, fetch=True)
+        if inserted:
+            notify(cur, MANIFEST_CHANNEL, "migrated")
+    return len(inserted)
@@ -1,10 +1,11 @@
 
 import json
-import psycopg2
 from datetime import datetime
-from config.db_config import DB_CONFIG
+from core.db_pool import get_connection, ensure_tables
 from core.invoice_generator import generate_invoice_for_po
-import requests
+from core import llm_client
+from core.mail_router import po_message_id
+from core.job_queue import JOB_TIMEOUT
 import os
 from dotenv import load_dotenv
 
@@ -17,7 +18,6 @@ load_dotenv()
 
 # Mock Email (Print to console) or Real SMTP can be swapped here
 ENABLE_EMAIL = True 
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
 LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:1.5b")
 
 EMAIL_SIGNATURE = """
@@ -31,33 +31,31 @@ Email: involexis.team@gmail.com
 # DB HELPERS
 # ============================================================
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
-
 def get_po_id_by_number(po_number):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT po_id FROM purchase_orders WHERE po_number = %s", (po_number,))
-    row = cur.fetchone()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT po_id FROM purchase_orders WHERE po_number = %s", (po_number,))
+        row = cur.fetchone()
     return row[0] if row else None
 
-def get_po_details(po_id):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    # Fetch Header
+def _read_po_details(cur, po_id):
     # Fetch Header and Raw JSON
     cur.execute("""
         SELECT po_number, buyer, supplier, total_amount, raw_json, sender_email
         FROM purchase_orders WHERE po_id = %s
     """, (po_id,))
     header = cur.fetchone()
-    
+
     if not header:
-        conn.close()
         return None, None
 
+    # Fetch Items
+    cur.execute("""
+        SELECT product_id, product_name, quantity, unit_price 
+        FROM purchase_order_items WHERE po_id = %s
+    """, (po_id,))
+    rows = cur.fetchall()
+
     # Parse raw_json for extra details like address
     raw_data = {}
     if header[4]:
@@ -85,13 +83,6 @@ def get_po_details(po_id):
         "buyer_email": final_email 
     }
 
-    # Fetch Items
-    cur.execute("""
-        SELECT product_id, product_name, quantity, unit_price 
-        FROM purchase_order_items WHERE po_id = %s
-    """, (po_id,))
-    rows = cur.fetchall()
-    
     items = []
     for r in rows:
         items.append({
@@ -101,9 +92,12 @@ def get_po_details(po_id):
             "unit_price": float(r[3] or 0)
         })
     
-    conn.close()
     return po_header, items
 
+def get_po_details(po_id):
+    with get_connection() as conn:
+        return _read_po_details(conn.cursor(), po_id)
+
 def get_inventory_batch(product_ids):
     """
     Fetch stock for multiple products in one query.
@@ -112,50 +106,65 @@ def get_inventory_batch(product_ids):
     if not product_ids:
         return {}
         
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    placeholders = ",".join(["%s"] * len(product_ids))
-    cur.execute(f"SELECT product_id, stock_available FROM inventory WHERE product_id IN ({placeholders})", tuple(product_ids))
-    
-    stock_map = {row[0]: row[1] for row in cur.fetchall()}
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        placeholders = ",".join(["%s"] * len(product_ids))
+        cur.execute(f"SELECT product_id, stock_available FROM inventory WHERE product_id IN ({placeholders})", tuple(product_ids))
+        stock_map = {row[0]: row[1] for row in cur.fetchall()}
     return stock_map
 
+def _deduct_stock(cur, allocations):
+    # Duplicate SKUs are summed first: UPDATE ... FROM applies one row per target
+    totals = {}
+    for item in allocations:
+        qty = item["allocatable"]
+        if qty > 0:
+            totals[item["product_id"]] = totals.get(item["product_id"], 0) + qty
+
+    if not totals:
+        return
+
+    cur.execute("""
+        UPDATE inventory AS inv
+        SET stock_available = inv.stock_available - a.qty
+        FROM unnest(%s::text[], %s::int[]) AS a(product_id, qty)
+        WHERE inv.product_id = a.product_id
+    """, (list(totals.keys()), list(totals.values())))
+
 def update_inventory_stock(allocations):
     """
     Deduct stock for allocated items.
     allocations = [{"product_id": "X", "allocatable": 5}, ...]
     """
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    for item in allocations:
-        qty = item["allocatable"]
-        if qty > 0:
-            cur.execute("""
-                UPDATE inventory SET stock_available = stock_available - %s 
-                WHERE product_id = %s
-            """, (qty, item["product_id"]))
-            
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        _deduct_stock(conn.cursor(), allocations)
 
 def update_po_status(po_id, status, notes=""):
-    conn = get_db_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE purchase_orders SET status = %s WHERE po_id = %s", (status, po_id))
-    # Optionally log notes to a separate log table
-    conn.commit()
-    conn.close()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("UPDATE purchase_orders SET status = %s WHERE po_id = %s", (status, po_id))
+        # Optionally log notes to a separate log table
+
+
+def transition_po_status(po_id, from_status, to_status):
+    """Compare-and-set status change. Returns False if another worker got there first."""
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            "UPDATE purchase_orders SET status = %s WHERE po_id = %s AND status = %s",
+            (to_status, po_id, from_status)
+        )
+        return cur.rowcount == 1
 
 
 def reconstruct_decisions(items, stock_map):
     decisions = []
+    # Track what is left so repeated SKUs on one PO don't share the same units
+    remaining = dict(stock_map)
     for item in items:
         pid = item["product_id"]
         req = item["requested"]
-        avail = stock_map.get(pid, 0)
+        avail = remaining.get(pid, 0) or 0
         
         alloc = 0
         status = "NONE"
@@ -166,6 +175,8 @@ def reconstruct_decisions(items, stock_map):
         elif avail > 0:
             alloc = avail
             status = "PARTIAL"
+
+        remaining[pid] = avail - alloc
         
         decisions.append({
             "product_id": pid,
@@ -178,6 +189,141 @@ def reconstruct_decisions(items, stock_map):
         })
     return decisions
 
+def classify_outcome(decisions):
+    if all(d["status"] == "FULL" for d in decisions):
+        return "FULL"
+    if all(d["status"] == "NONE" for d in decisions):
+        return "NONE"
+    return "PARTIAL"
+
+# ============================================================
+# ALLOCATION ENGINE (single transaction, row-level locks)
+# ============================================================
+
+def allocate_po(po_id, expected_status="NEW", accept_partial=False, job_id=None):
+    """
+    Lock the PO and its inventory rows (SELECT ... FOR UPDATE), decide the
+    allocation, deduct stock and move the PO to its next status in ONE
+    transaction, so parallel agent workers can never oversell a SKU.
+
+    accept_partial=False (new PO): only a FULL outcome deducts stock.
+    accept_partial=True (customer approved): whatever is available is deducted.
+    job_id: the agent job allocating; it holds the invoice lease (see resume_allocation).
+
+    Returns (header, decisions, outcome) where outcome is FULL / PARTIAL / NONE,
+    or outcome=None if the PO is missing or no longer in expected_status.
+    """
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+
+        # 1. Lock the PO row first; a second worker blocks here, then sees the new status
+        cur.execute("SELECT status FROM purchase_orders WHERE po_id = %s FOR UPDATE", (po_id,))
+        row = cur.fetchone()
+        if not row:
+            print("❌ PO Not Found")
+            return None, [], None
+        if row[0] != expected_status:
+            print(f"⏭️ PO {po_id} is {row[0]} (expected {expected_status}), skipping.")
+            return None, [], None
+
+        header, items = _read_po_details(cur, po_id)
+
+        # 2. Lock inventory rows in a stable order so concurrent POs can't deadlock
+        product_ids = sorted({i["product_id"] for i in items if i["product_id"]})
+        stock_map = {}
+        if product_ids:
+            cur.execute("""
+                SELECT product_id, stock_available FROM inventory
+                WHERE product_id = ANY(%s)
+                ORDER BY product_id
+                FOR UPDATE
+            """, (product_ids,))
+            stock_map = {r[0]: r[1] for r in cur.fetchall()}
+
+        decisions = reconstruct_decisions(items, stock_map)
+        outcome = classify_outcome(decisions)
+        available_items = [d for d in decisions if d["allocatable"] > 0]
+
+        # 3. Deduct + set status. ALLOCATED = stock reserved, invoice/email pending.
+        if accept_partial or outcome == "FULL":
+            to_deduct = available_items
+            status = "ALLOCATED" if available_items else "FAILED_NO_STOCK"
+        elif outcome == "PARTIAL" and available_items:
+            to_deduct = []
+            status = "WAITING_FOR_REPLY"
+        else:
+            to_deduct = []
+            status = "FAILED_NO_STOCK"
+
+        _deduct_stock(cur, to_deduct)
+        cur.execute("UPDATE purchase_orders SET status = %s WHERE po_id = %s", (status, po_id))
+        if status == "ALLOCATED":
+            cur.execute("""
+                INSERT INTO po_allocations (po_id, accepted_partial, outcome, decisions, job_id, locked_at)
+                VALUES (%s, %s, %s, %s, %s, NOW())
+                ON CONFLICT (po_id) DO UPDATE
+                SET accepted_partial = EXCLUDED.accepted_partial,
+                    outcome = EXCLUDED.outcome,
+                    decisions = EXCLUDED.decisions,
+                    job_id = EXCLUDED.job_id,
+                    locked_at = EXCLUDED.locked_at,
+                    created_at = CURRENT_TIMESTAMP
+            """, (po_id, accept_partial, outcome, json.dumps(decisions), job_id))
+
+    return header, decisions, outcome
+
+
+def resume_allocation(po_id, accepted_partial, job_id=None):
+    """
+    A job that failed after allocate_po committed (invoice or email step)
+    comes back with the PO already ALLOCATED. Returns the stored
+    (header, decisions, outcome) so those steps run again without deducting
+    stock twice, and takes the invoice lease for this attempt.
+
+    Only the job that made the allocation resumes it: any other job (a
+    second "yes" reply, a manual run) gets outcome=None and does nothing.
+    Raises while an earlier attempt of the same job still holds the lease
+    (it was reclaimed as stale but may still be running), so this attempt
+    retries later instead of sending a second invoice; a lease older than
+    JOB_TIMEOUT belongs to a dead worker and is taken over. Also raises if
+    the PO is ALLOCATED but the allocation was never recorded, so the job
+    fails visibly instead of completing with no invoice sent.
+    """
+    ensure_tables()
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT status FROM purchase_orders WHERE po_id = %s FOR UPDATE", (po_id,))
+        row = cur.fetchone()
+        if not row or row[0] != "ALLOCATED":
+            return None, [], None
+
+        cur.execute("""
+            SELECT accepted_partial, outcome, decisions, job_id,
+                   locked_at > NOW() - make_interval(secs => %s)
+            FROM po_allocations WHERE po_id = %s
+        """, (JOB_TIMEOUT, po_id))
+        alloc = cur.fetchone()
+        if not alloc:
+            raise RuntimeError(f"PO {po_id} is ALLOCATED but has no recorded allocation; needs manual invoicing")
+        if alloc[0] != accepted_partial or job_id is None or alloc[3] != job_id:
+            print(f"⏭️ PO {po_id} is ALLOCATED by job {alloc[3]}, skipping.")
+            return None, [], None
+        if alloc[4]:
+            raise RuntimeError(f"PO {po_id} is still being invoiced by an earlier attempt of job {job_id}")
+
+        cur.execute("UPDATE po_allocations SET locked_at = NOW() WHERE po_id = %s", (po_id,))
+        header, _ = _read_po_details(cur, po_id)
+
+    print(f"↩️ PO {po_id} already ALLOCATED, resuming invoice and email")
+    return header, json.loads(alloc[2]), alloc[1]
+
+
+def release_allocation(po_id):
+    """Drop the invoice lease after a failed attempt, so the job's retry can resume at once."""
+    with get_connection() as conn:
+        conn.cursor().execute("UPDATE po_allocations SET locked_at = NULL WHERE po_id = %s", (po_id,))
+
 # ============================================================
 # LLM HELPER (for Email Body)
 # ============================================================
@@ -185,12 +331,7 @@ def reconstruct_decisions(items, stock_map):
 def generate_email_body(prompt):
     full_prompt = f"{prompt}\n\nIMPORTANT: Do NOT include any signature or closing like 'Best regards', '[Your Name]', etc. Just write the body of the email. I will add the signature automatically."
     try:
-        res = requests.post(OLLAMA_URL, json={
-            "model": LLM_MODEL,
-            "prompt": full_prompt,
-            "stream": False
-        }, timeout=30)
-        body = res.json().get("response", "").strip()
+        body = llm_client.generate(full_prompt, LLM_MODEL, timeout=30).strip()
         
         # 1. Replace Placeholders with Real Info
         replacements = {
@@ -241,7 +382,7 @@ SMTP_PORT = 587
 EMAIL_USER = os.getenv("EMAIL_USER")
 EMAIL_PASS = os.getenv("EMAIL_PASS")
 
-def send_email(to_email, subject, body, attachment_path=None):
+def send_email(to_email, subject, body, attachment_path=None, po_id=None):
     if not to_email:
         print("❌ Cannot send email: No recipient address found.")
         return
@@ -251,6 +392,9 @@ def send_email(to_email, subject, body, attachment_path=None):
         msg['From'] = EMAIL_USER
         msg['To'] = to_email
         msg['Subject'] = subject
+        if po_id is not None:
+            # Lets the mailbox service match the customer's reply to this PO
+            msg['Message-ID'] = po_message_id(po_id)
 
         full_body = f"{body}\n\n{EMAIL_SIGNATURE}"
         msg.attach(MIMEText(full_body, 'plain'))
@@ -284,9 +428,10 @@ def send_email(to_email, subject, body, attachment_path=None):
 # REPLY HANDLER (CALLED BY LISTENER)
 # ============================================================
 
-def handle_partial_response(po_id_or_num, decision):
+def handle_partial_response(po_id_or_num, decision, job_id=None):
     """
     decision: 'APPROVE' or 'REJECT'
+    job_id: the agent job running this (None for direct calls from scripts)
     """
     if isinstance(po_id_or_num, str) and not po_id_or_num.isdigit():
         po_id = get_po_id_by_number(po_id_or_num)
@@ -300,78 +445,71 @@ def handle_partial_response(po_id_or_num, decision):
     print(f"🔄 Handling Partial Response for PO {po_id}: {decision}")
     
     if decision == "REJECT":
-        update_po_status(po_id, "CANCELLED_BY_CUSTOMER")
-        print("❌ PO Cancelled by customer request.")
+        if transition_po_status(po_id, "WAITING_FOR_REPLY", "CANCELLED_BY_CUSTOMER"):
+            print("❌ PO Cancelled by customer request.")
+        else:
+            print(f"⏭️ PO {po_id} is not waiting for a reply, ignoring REJECT.")
         return
 
     if decision == "APPROVE":
-        # 1. Re-check inventory (stock might have changed!)
-        header, items = get_po_details(po_id)
-        product_ids = [i["product_id"] for i in items]
-        stock_map = get_inventory_batch(product_ids)
-        
-        decisions = reconstruct_decisions(items, stock_map)
-        
+        # 1. Re-check inventory (stock might have changed!) and deduct what is
+        #    available, all under row locks in one transaction
+        header, decisions, outcome = allocate_po(po_id, expected_status="WAITING_FOR_REPLY", accept_partial=True, job_id=job_id)
+        if outcome is None:
+            # Retry of a job that failed after the deduction committed
+            header, decisions, outcome = resume_allocation(po_id, accepted_partial=True, job_id=job_id)
+            if outcome is None:
+                return
+
         # 2. Allocate what is available
         available_items = [d for d in decisions if d["allocatable"] > 0]
         
         if not available_items:
             print("❌ Stock ran out while waiting for reply!")
-            update_po_status(po_id, "FAILED_NO_STOCK")
             return
 
-        # 3. Deduct Stock
-        update_inventory_stock(available_items)
-        
-        # 4. Generate Invoice (now treated as Final)
-        pdf_path = generate_invoice_for_po(po_id, header, available_items)
-        print(f"📄 Partial Invoice Generated: {pdf_path}")
-        
-        body = generate_email_body(f"Write a thank you email to {header['buyer']} confirming partial shipment for PO {header['po_number']}.")
-        body = generate_email_body(f"Write a thank you email to {header['buyer']} confirming partial shipment for PO {header['po_number']}.")
-        send_email(header.get("buyer_email"), f"Confirmed: Partial Shipment for PO {header['po_number']}", body, pdf_path)
-        
-        update_po_status(po_id, "PARTIAL_COMPLETED")
+        # 3. Generate Invoice (now treated as Final)
+        try:
+            pdf_path = generate_invoice_for_po(po_id, header, available_items)
+            print(f"📄 Partial Invoice Generated: {pdf_path}")
+
+            body = generate_email_body(f"Write a thank you email to {header['buyer']} confirming partial shipment for PO {header['po_number']}.")
+            send_email(header.get("buyer_email"), f"Confirmed: Partial Shipment for PO {header['po_number']}", body, pdf_path, po_id=po_id)
+
+            update_po_status(po_id, "PARTIAL_COMPLETED")
+        except Exception:
+            release_allocation(po_id)
+            raise
 
 # ============================================================
 # CORE AGENT LOGIC
 # ============================================================
 
-def process_po(po_id):
+def process_po(po_id, job_id=None):
     print(f"🤖 Agent Processing PO: {po_id}")
     
-    header, items = get_po_details(po_id)
-    if not header:
-        print("❌ PO Not Found")
-        return
-
-    # 1. Check Inventory
-    product_ids = [i["product_id"] for i in items]
-    stock_map = get_inventory_batch(product_ids)
-    
-    decisions = reconstruct_decisions(items, stock_map)
-
-    # 2. Analyze Outcome
-    all_full = all(d["status"] == "FULL" for d in decisions)
-    all_none = all(d["status"] == "NONE" for d in decisions)
-    # has_partial = any(d["status"] == "PARTIAL" for d in decisions) or (not all_full and not all_none)
+    # 1. Check Inventory, deduct and set status in one locked transaction
+    header, decisions, outcome = allocate_po(po_id, job_id=job_id)
+    if outcome is None:
+        # Retry of a job that failed after the deduction committed
+        header, decisions, outcome = resume_allocation(po_id, accepted_partial=False, job_id=job_id)
+        if outcome is None:
+            return
 
-    # 3. Take Action
+    # 2. Take Action (stock and status are already committed)
     
-    if all_full:
+    if outcome == "FULL":
         print("✅ Full Stock Available. Generating Invoice...")
         
-        # Deduct Stock
-        update_inventory_stock(decisions)
-        
-        # Generate Invoice
-        pdf_path = generate_invoice_for_po(po_id, header, decisions)
-        print(f"📄 Invoice Generated: {pdf_path}")
-        
-        # Send Email
-        # Send Email
-        subject = f"Invoice Submission – {header['po_number']}"
-        body = f"""Dear {header['buyer']},
+        try:
+            # Generate Invoice
+            pdf_path = generate_invoice_for_po(po_id, header, decisions)
+            print(f"📄 Invoice Generated: {pdf_path}")
+            
+            # Send Email
+            # Send Email
+            subject = f"Invoice Submission – {header['po_number']}"
+            body = f"""Dear {header['buyer']},
 
 I hope this email finds you well.
 
@@ -380,12 +518,15 @@ Please find attached the fully generated invoice {header['po_number']} for the s
 Thank you for your cooperation. I look forward to your confirmation.
 
 Warm regards,"""
-        
-        send_email(header.get("buyer_email"), subject, body, pdf_path)
-        
-        update_po_status(po_id, "COMPLETED")
+            
+            send_email(header.get("buyer_email"), subject, body, pdf_path, po_id=po_id)
+            
+            update_po_status(po_id, "COMPLETED")
+        except Exception:
+            release_allocation(po_id)
+            raise
 
-    elif all_none:
+    elif outcome == "NONE":
         print("❌ No Stock Available. Sending Apology.")
         
         prompt = f"""
@@ -403,9 +544,7 @@ Warm regards,"""
         """
         body = generate_email_body(prompt)
         
-        send_email(header.get("buyer_email"), f"Update on PO {header['po_number']}", body)
-        
-        update_po_status(po_id, "FAILED_NO_STOCK")
+        send_email(header.get("buyer_email"), f"Update on PO {header['po_number']}", body, po_id=po_id)
 
     else:
         # Partition Case (Partial or Mixed Full/None)
@@ -415,8 +554,7 @@ Warm regards,"""
         available_items = [d for d in decisions if d["allocatable"] > 0]
         
         if not available_items:
-             # Should be covered by all_none, but safe fallback
-             update_po_status(po_id, "FAILED_NO_STOCK")
+             # Should be covered by NONE; allocate_po already marked it FAILED_NO_STOCK
              return
 
         # NEW FLOW: Don't generate invoice yet. Send email listing available items.
@@ -440,9 +578,7 @@ Warm regards,"""
         """
         
         body = generate_email_body(prompt)
-        send_email(header.get("buyer_email"), f"Update: Partial Stock for PO {header['po_number']}", body)
-        
-        update_po_status(po_id, "WAITING_FOR_REPLY")
+        send_email(header.get("buyer_email"), f"Update: Partial Stock for PO {header['po_number']}", body, po_id=po_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,168 @@
+import statistics
+
+# ============================================================
+# STRUCTURED PAGE MODEL
+# ============================================================
+# Words with boxes and confidence (from PaddleOCR or the PDF text layer),
+# grouped into rows and cells, with column bands recovered from the
+# gaps between cells. Rendered back to text one row per line with cells
+# separated by " | ", so the LLM (or rule parser) sees tables as tables
+# instead of one jumbled line per page.
+#
+# {"page": 1, "source": "ocr" | "pdf", "width": ..., "height": ...,
+#  "words": [{"text", "score", "box": [x0, y0, x1, y1]}],
+#  "columns": [[x0, x1], ...],
+#  "rows": [{"box": [...], "cells": [{"text", "box", "col", "score"}]}]}
+
+ROW_TOLERANCE = 0.5     # vertical centre distance, as a fraction of word height
+CELL_GAP = 1.2          # horizontal gap (in word heights) that starts a new cell
+MIN_TABLE_CELLS = 3     # rows with at least this many cells are treated as table rows
+CELL_SEPARATOR = " | "
+
+
+def word_from_ocr(item):
+    """run_ocr_batch box dict (4-point polygon) -> word."""
+    xs = [p[0] for p in item["box"]]
+    ys = [p[1] for p in item["box"]]
+    return {
+        "text": item["text"],
+        "score": round(float(item["score"]), 4),
+        "box": [min(xs), min(ys), max(xs), max(ys)]
+    }
+
+
+def word_from_pdf(w):
+    """pdfplumber extract_words() entry -> word (text layer is exact: score 1)."""
+    return {"text": w["text"], "score": 1.0, "box": [w["x0"], w["top"], w["x1"], w["bottom"]]}
+
+
+def _height(box):
+    return max(box[3] - box[1], 1.0)
+
+
+def _centre_y(box):
+    return (box[1] + box[3]) / 2
+
+
+def _union(boxes):
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes),
+            max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def _group_rows(words):
+    rows = []
+    for w in sorted(words, key=lambda w: (_centre_y(w["box"]), w["box"][0])):
+        if rows:
+            last = rows[-1]
+            tolerance = max(_height(w["box"]), last["height"]) * ROW_TOLERANCE
+            if abs(_centre_y(w["box"]) - last["cy"]) <= tolerance:
+                last["words"].append(w)
+                last["cy"] = statistics.mean(_centre_y(x["box"]) for x in last["words"])
+                continue
+        rows.append({"words": [w], "cy": _centre_y(w["box"]), "height": _height(w["box"])})
+    return [sorted(r["words"], key=lambda w: w["box"][0]) for r in rows]
+
+
+def _split_cells(row_words, gap):
+    cells = []
+    for w in row_words:
+        if cells and w["box"][0] - cells[-1][-1]["box"][2] <= gap:
+            cells[-1].append(w)
+        else:
+            cells.append([w])
+    return [
+        {
+            "text": " ".join(w["text"] for w in cell),
+            "box": _union([w["box"] for w in cell]),
+            "score": round(min(w["score"] for w in cell), 4),
+            "col": None
+        }
+        for cell in cells
+    ]
+
+
+def _column_bands(rows):
+    """Merge the x-extents of table-row cells; each merged band is a column."""
+    spans = sorted(
+        (c["box"][0], c["box"][2])
+        for row in rows if len(row) >= MIN_TABLE_CELLS
+        for c in row
+    )
+    bands = []
+    for x0, x1 in spans:
+        if bands and x0 <= bands[-1][1]:
+            bands[-1][1] = max(bands[-1][1], x1)
+        else:
+            bands.append([x0, x1])
+    return bands
+
+
+def _column_of(cell, bands):
+    cx = (cell["box"][0] + cell["box"][2]) / 2
+    for i, (x0, x1) in enumerate(bands):
+        if x0 <= cx <= x1:
+            return i
+    return None
+
+
+def build_page(page_no, words, width, height, source):
+    words = [w for w in words if w["text"].strip()]
+    if words:
+        gap = statistics.median(_height(w["box"]) for w in words) * CELL_GAP
+    else:
+        gap = 0
+
+    rows = [_split_cells(r, gap) for r in _group_rows(words)]
+    bands = _column_bands(rows)
+    for row in rows:
+        if len(row) >= MIN_TABLE_CELLS:
+            for cell in row:
+                cell["col"] = _column_of(cell, bands)
+
+    return {
+        "page": page_no,
+        "source": source,
+        "width": width,
+        "height": height,
+        "words": words,
+        "columns": bands,
+        "rows": [{"box": _union([c["box"] for c in row]), "cells": row} for row in rows]
+    }
+
+
+def pages_from_pdf_layout(layout):
+    """Page models from rule_parser.read_layout() output (digital PDFs)."""
+    return [
+        build_page(i + 1, [word_from_pdf(w) for w in words], width, height, "pdf")
+        for i, (words, (width, height)) in enumerate(zip(layout["words"], layout["sizes"]))
+    ]
+
+
+def page_text(page):
+    """One line per row, cells separated by ' | '."""
+    return "\n".join(CELL_SEPARATOR.join(c["text"] for c in row["cells"]) for row in page["rows"])
+
+
+def tables(pages):
+    """
+    Runs of consecutive table rows as pdfplumber-style tables (list of rows
+    of cell strings, one slot per column band), for the rule parser.
+    """
+    found = []
+    for page in pages:
+        ncols = len(page["columns"])
+        current = []
+        for row in page["rows"]:
+            cells = row["cells"]
+            if len(cells) >= MIN_TABLE_CELLS and ncols:
+                slots = [""] * ncols
+                for c in cells:
+                    if c["col"] is not None:
+                        slots[c["col"]] = (slots[c["col"]] + " " + c["text"]).strip()
+                current.append(slots)
+            elif current:
+                found.append(current)
+                current = []
+        if current:
+            found.append(current)
+    return found
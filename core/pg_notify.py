@@ -0,0 +1,88 @@
+import select
+import threading
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+
+from config.db_config import DB_CONFIG
+
+# ============================================================
+# LISTEN / NOTIFY HELPERS
+# ============================================================
+# NOTIFY is transactional: a notification sent on a cursor is only
+# delivered when that transaction commits, so listeners never see a
+# job/PO before its rows are visible.
+
+
+def notify(cur, channel, payload=""):
+    cur.execute("SELECT pg_notify(%s, %s)", (channel, str(payload)))
+
+
+class Wakeup:
+    """
+    Lost-wakeup-safe signal between a listener thread and worker threads.
+    Workers read generation() BEFORE checking for work and pass it to
+    wait(); a signal that lands in between makes wait() return at once.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._gen = 0
+
+    def generation(self):
+        with self._cond:
+            return self._gen
+
+    def signal(self):
+        with self._cond:
+            self._gen += 1
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout):
+        with self._cond:
+            if self._gen == seen:
+                self._cond.wait(timeout)
+            return self._gen != seen
+
+
+def listen_forever(channels, on_notify, stop_event, reconnect_delay=5):
+    """
+    Block on LISTEN for the given channels until stop_event is set, calling
+    on_notify(notification) for each one. Uses a dedicated autocommit
+    connection (never a pooled one) and reconnects after failures; on every
+    (re)connect on_notify(None) is called so callers can catch up on
+    anything sent while nobody was listening.
+    """
+    while not stop_event.is_set():
+        conn = None
+        try:
+            conn = psycopg2.connect(**DB_CONFIG)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cur = conn.cursor()
+            for channel in channels:
+                cur.execute(sql.SQL("LISTEN {};").format(sql.Identifier(channel)))
+
+            print(f"👂 Listening on: {', '.join(channels)}")
+            on_notify(None)
+
+            while not stop_event.is_set():
+                # Short select timeout so shutdown is noticed promptly
+                if select.select([conn], [], [], 1.0) == ([], [], []):
+                    continue
+
+                conn.poll()
+                while conn.notifies:
+                    on_notify(conn.notifies.pop(0))
+
+        except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+            print(f"⚠️ LISTEN connection lost: {e}. Reconnecting in {reconnect_delay}s...")
+            stop_event.wait(reconnect_delay)
+        except Exception as e:
+            # A callback or decode error must not kill the listener thread,
+            # or workers silently fall back to their slow poll
+            print(f"⚠️ LISTEN loop error: {e!r}. Reconnecting in {reconnect_delay}s...")
+            stop_event.wait(reconnect_delay)
+        finally:
+            if conn is not None:
+                conn.close()
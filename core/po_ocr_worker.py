@@ -1,16 +1,20 @@
 import os
 import json
 import shutil
-import requests
 import pdfplumber
+import threading
+import time
 import numpy as np
 import cv2
 
-from pdf2image import convert_from_path
-from paddleocr import PaddleOCR
+from concurrent.futures import ThreadPoolExecutor
+
+from pdf2image import convert_from_path, pdfinfo_from_path
 
 from core.db_insert import insert_po
 from core.converter import ensure_pdf
+from core.manifest_store import claim_entry, claim_next_pending, touch_claim, mark_processed, mark_failed
+from core import extraction_cache, llm_client, rule_parser, layout_templates, po_schema, image_preprocess, page_layout
 
 
 # ================= CONFIG ================= #
@@ -21,98 +25,302 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INCOMING = os.path.join(BASE_DIR, "incoming")
 PROCESSING = os.path.join(BASE_DIR, "processing")
 OUTPUT = os.path.join(BASE_DIR, "processed_json")
+# Page models (words, boxes, rows, columns); a subdirectory so tools that
+# read every processed_json/*.json only see PO records
+LAYOUT_OUTPUT = os.path.join(OUTPUT, "layout")
 FAILED = os.path.join(BASE_DIR, "failed")
-MANIFEST = os.path.join(BASE_DIR, "manifest.json")
 
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434/api/generate")
 LLM_MODEL = os.getenv("LLM_MODEL", "qwen2.5:1.5b")
 
+# Claimed files are touched this often while they are processed; the OCR
+# service only requeues claims silent for OCR_CLAIM_TIMEOUT
+CLAIM_HEARTBEAT = int(os.getenv("OCR_CLAIM_HEARTBEAT", "60"))   # seconds
+
+# Pages read per document (0 = all). Was a hard-coded 3.
+PDF_MAX_PAGES = int(os.getenv("PDF_MAX_PAGES", "10"))
+# A page whose text layer has fewer characters than this is OCRed
+MIN_PAGE_TEXT_CHARS = int(os.getenv("MIN_PAGE_TEXT_CHARS", "50"))
+OCR_DPI = int(os.getenv("OCR_DPI", "150"))
+# Adaptive DPI: words PaddleOCR scores below OCR_RECHECK_SCORE are read
+# again from a OCR_HIGH_DPI render of just their region
+OCR_ADAPTIVE_DPI = os.getenv("OCR_ADAPTIVE_DPI", "1") == "1"
+OCR_HIGH_DPI = int(os.getenv("OCR_HIGH_DPI", "300"))
+OCR_RECHECK_SCORE = float(os.getenv("OCR_RECHECK_SCORE", "0.85"))
+OCR_RECHECK_MAX = int(os.getenv("OCR_RECHECK_MAX", "40"))      # regions per page
+# Scanned pages per OCR call (PaddleOCR 3.x batches them in one predict)
+OCR_BATCH_SIZE = int(os.getenv("OCR_BATCH_SIZE", "4"))
+# Text boxes per recognition forward pass
+OCR_REC_BATCH_SIZE = int(os.getenv("OCR_REC_BATCH_SIZE", "16"))
+
+# OCR text longer than this is extracted in overlapping chunks instead of
+# being truncated
+LLM_CHUNK_CHARS = int(os.getenv("LLM_CHUNK_CHARS", "4500"))
+LLM_CHUNK_OVERLAP = int(os.getenv("LLM_CHUNK_OVERLAP", "400"))
+# End of the document sent with the first chunk for header fields (totals)
+LLM_HEADER_TAIL_CHARS = 1000
+
+# Bump when the extraction prompt / text pipeline changes so cached results
+# from the old version are not reused
+PROMPT_VERSION = "3"
+TEXT_VERSION = "3"
+
 # ========================================= #
 
 os.makedirs(PROCESSING, exist_ok=True)
 os.makedirs(OUTPUT, exist_ok=True)
 os.makedirs(FAILED, exist_ok=True)
 
-# Optimized PaddleOCR Settings
-# use_angle_cls=False for speed if orientation is fixed
-# limit_side_len=1280 for faster processing of large images
-ocr = PaddleOCR(lang="en", use_angle_cls=False)
-
+# ================= OCR ENGINE ================= #
 
+# PaddleOCR (and paddle itself) is only imported and loaded on the first
+# scanned page, so importing this module - or handling a digital PDF via
+# pdfplumber - never pays the model load. One engine is shared per process.
+_ocr_engine = None
+_ocr_lock = threading.Lock()
 
-# ================= MANIFEST ================= #
 
-def load_manifest():
+def _paddleocr_major():
+    import paddleocr
     try:
-        with open(MANIFEST) as f:
-            return json.load(f)
-    except:
-        return {}
-
+        return int(str(getattr(paddleocr, "__version__", "2")).split(".")[0])
+    except ValueError:
+        return 2
+
+
+def get_ocr_engine():
+    global _ocr_engine
+    if _ocr_engine is None:
+        with _ocr_lock:
+            if _ocr_engine is None:
+                from paddleocr import PaddleOCR
+
+                print("🧠 Loading PaddleOCR model...")
+                # Optimized PaddleOCR Settings
+                # use_angle_cls=False for speed if orientation is fixed
+                # limit_side_len=1280 for faster processing of large images
+                # Recognition batch size: text boxes recognised per forward pass
+                if _paddleocr_major() >= 3:
+                    _ocr_engine = PaddleOCR(lang="en", use_textline_orientation=False,
+                                            text_recognition_batch_size=OCR_REC_BATCH_SIZE)
+                else:
+                    _ocr_engine = PaddleOCR(lang="en", use_angle_cls=False,
+                                            rec_batch_num=OCR_REC_BATCH_SIZE)
+    return _ocr_engine
+
+
+def warm_up_ocr():
+    """
+    Optional hook for long-running workers: load the model and run one tiny
+    inference up front so the first real scanned page isn't slowed down.
+    """
+    get_ocr_engine()
+    try:
+        run_ocr_batch([np.full((32, 32), 255, dtype=np.uint8)])
+    except Exception as e:
+        print(f"⚠️ OCR warm-up inference failed (model is loaded): {e}")
 
-def save_manifest(m):
-    with open(MANIFEST, "w") as f:
-        json.dump(m, f, indent=2)
 
 
 # ================= OCR ================= #
 
-def extract_text_from_pdf(pdf_path):
+def _boxes_v2(page_result):
+    """PaddleOCR 2.x page result: [[box, (text, score)], ...] (None if empty)."""
+    return [
+        {"text": res[1][0], "score": float(res[1][1]), "box": [[float(x), float(y)] for x, y in res[0]]}
+        for res in (page_result or [])
+    ]
+
+
+def _boxes_v3(page_result):
+    """PaddleOCR 3.x result object: parallel rec_texts / rec_scores / rec_polys."""
+    polys = page_result.get("rec_polys", page_result.get("dt_polys", []))
+    return [
+        {"text": text, "score": float(score), "box": [[float(x), float(y)] for x, y in poly]}
+        for text, score, poly in zip(page_result["rec_texts"], page_result["rec_scores"], polys)
+    ]
+
+
+def run_ocr_batch(images):
     """
-    1. Try digital PDF text extraction
-    2. Fallback to PaddleOCR for scanned PDFs
+    OCR several page images. Returns one list of {"text", "score", "box"}
+    per image. PaddleOCR 3.x takes the whole list in one predict() call;
+    2.x only accepts one image per call.
+    """
+    engine = get_ocr_engine()
+    if hasattr(engine, "predict"):
+        return [_boxes_v3(r) for r in engine.predict(list(images))]
+    return [_boxes_v2((engine.ocr(img) or [None])[0]) for img in images]
+
+
+def _to_gray(img):
+    """PIL page -> grayscale array; the PIL image is released."""
+    gray = np.asarray(img)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+    img.close()
+    return gray
+
+
+def _prepare_page(img):
+    """PIL page -> (preprocessed grayscale array, transform back to the render)."""
+    return image_preprocess.preprocess(_to_gray(img))
+
+
+def render_page(pdf_path, page_no, dpi=OCR_DPI):
+    """One page, rendered by poppler directly in grayscale (no RGB copy)."""
+    return convert_from_path(pdf_path, dpi=dpi, first_page=page_no, last_page=page_no, grayscale=True)[0]
+
+
+def _batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def extract_layout_from_pdf(pdf_path, max_pages=PDF_MAX_PAGES):
+    """
+    Per-page hybrid extraction:
+    1. Use the digital text layer (pdfplumber) for every page that has one
+    2. OCR only the pages that don't (scans, scanned annexures)
+
+    Returns (text, pages): pages is the structured page model (words with
+    boxes and confidence, rows, columns) - see core/page_layout.py.
+    OCRed pages are rendered into the text one table row per line.
     """
     print(f"📄 Extracting text from: {os.path.basename(pdf_path)}")
+
+    page_texts = []
+    pages = []
     try:
         with pdfplumber.open(pdf_path) as pdf:
-            first_page_text = pdf.pages[0].extract_text() or ""
-            # If we get enough text digitally, skip heavy OCR
-            if len(first_page_text.strip()) > 100:
-                print("⚡ Using digital text extraction (Fast)")
-                return "\n".join(p.extract_text() or "" for p in pdf.pages[:3])
+            pdf_pages = pdf.pages[:max_pages] if max_pages else pdf.pages
+            for i, p in enumerate(pdf_pages):
+                page_texts.append(p.extract_text() or "")
+                words = [page_layout.word_from_pdf(w) for w in p.extract_words()]
+                pages.append(page_layout.build_page(i + 1, words, float(p.width), float(p.height), "pdf"))
     except Exception as e:
         print(f"⚠️ Digital extraction failed: {e}")
 
-    print("🖼️ Digital extraction yielded little text. Falling back to Scanned OCR (Slower)...")
-    text = ""
-    # Use multiple threads for PDF conversion and lower DPI for speed
-    images = convert_from_path(pdf_path, dpi=150, first_page=1, last_page=3, thread_count=4)
+    if not page_texts:
+        # No readable text layer at all: OCR every page up to the limit
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        if max_pages:
+            page_count = min(page_count, max_pages)
+        page_texts = [""] * page_count
+        pages = [None] * page_count
 
-    for i, img in enumerate(images):
-        print(f"📸 Processing page {i+1}...")
-        gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2GRAY)
-        # Use simple OCR call for speed
-        result = ocr.ocr(gray)
-        if result:
-            for line in result:
-                if line:
-                    for res in line:
-                        text += res[1][0] + " "
-                    text += "\n"
+    scanned = [i + 1 for i, t in enumerate(page_texts) if len(t.strip()) < MIN_PAGE_TEXT_CHARS]
 
-    return text
+    if not scanned:
+        print(f"⚡ Using digital text extraction for all {len(page_texts)} page(s) (Fast)")
+        return "\n".join(page_texts), pages
 
+    print(f"🖼️ OCR needed for page(s) {scanned} of {len(page_texts)} (Slower)...")
+    for batch in _batched(_scanned_page_images(pdf_path, scanned), OCR_BATCH_SIZE):
+        print(f"📸 Processing page(s) {[page_no for page_no, _, _ in batch]}...")
+        results = run_ocr_batch([gray for _, gray, _ in batch])
+        for (page_no, gray, transform), boxes in zip(batch, results):
+            if OCR_ADAPTIVE_DPI:
+                boxes = recheck_low_confidence(pdf_path, page_no, boxes, transform)
+            height, width = gray.shape[:2]
+            words = [page_layout.word_from_ocr(b) for b in boxes]
+            page = page_layout.build_page(page_no, words, width, height, "ocr")
+            ocr_text = page_layout.page_text(page)
+            # Keep whatever little digital text there was if OCR found nothing
+            if ocr_text.strip():
+                page_texts[page_no - 1] = ocr_text
+                pages[page_no - 1] = page
 
+    return "\n".join(page_texts), [p for p in pages if p is not None]
 
 
-# ================= LLM ================= #
+def extract_text_from_pdf(pdf_path, max_pages=PDF_MAX_PAGES):
+    return extract_layout_from_pdf(pdf_path, max_pages)[0]
 
-def extract_po_with_llm(text):
-    prompt = f"""
-You are extracting structured Purchase Order data from noisy OCR text.
 
-CRITICAL RULES:
-- Return ONLY valid JSON
-- Do NOT hallucinate values
-- If a field is missing, return empty string ""
-- Do NOT mix fields (dates must not appear as quantity)
-- Monetary fields must contain ONLY numbers (no commas, no currency symbols)
-- Preserve vendor text in raw fields
+def _scanned_page_images(pdf_path, scanned):
+    """
+    Yield (page_no, preprocessed grayscale array, transform) one page at a
+    time, so at most one OCR batch of pages is in memory however long the
+    document is.
+    """
+    for page_no in scanned:
+        gray, transform = _prepare_page(render_page(pdf_path, page_no))
+        yield page_no, gray, transform
 
-RETURN JSON IN THIS EXACT STRUCTURE:
 
-{{
-  "po_number": "",
+def _centre(box):
+    return sum(p[0] for p in box) / len(box), sum(p[1] for p in box) / len(box)
+
+
+def recheck_low_confidence(pdf_path, page_no, boxes, transform):
+    """
+    Adaptive DPI: re-OCR the words scored below OCR_RECHECK_SCORE from an
+    OCR_HIGH_DPI render, cropped to each word's region, and keep the new
+    reading where it scores higher. Only small crops go through OCR, so
+    the cost stays close to the low-DPI pass.
+    """
+    weak = [i for i, b in enumerate(boxes) if b["score"] < OCR_RECHECK_SCORE][:OCR_RECHECK_MAX]
+    if not weak or OCR_HIGH_DPI <= OCR_DPI:
+        return boxes
+
+    start = time.perf_counter()
+    high = _to_gray(render_page(pdf_path, page_no, OCR_HIGH_DPI))
+    H, W = high.shape[:2]
+    scale = OCR_HIGH_DPI / OCR_DPI
+
+    crops, regions = [], []
+    for i in weak:
+        # OCR box (preprocessed image) -> low-DPI render -> high-DPI render
+        src = image_preprocess.to_source(transform, boxes[i]["box"]) * scale
+        x0, y0 = src.min(axis=0)
+        x1, y1 = src.max(axis=0)
+        pad = (y1 - y0) * 0.3 + 4
+        cx0, cy0 = int(max(0, x0 - pad)), int(max(0, y0 - pad))
+        cx1, cy1 = int(min(W, x1 + pad)), int(min(H, y1 + pad))
+        if cx1 - cx0 < 8 or cy1 - cy0 < 8:
+            continue
+        crops.append(np.ascontiguousarray(high[cy0:cy1, cx0:cx1]))
+        regions.append((i, (x0 - cx0, y0 - cy0, x1 - cx0, y1 - cy0)))
+    del high
+
+    boxes = list(boxes)
+    improved = 0
+    for (i, (rx0, ry0, rx1, ry1)), found in zip(regions, run_ocr_batch(crops) if crops else []):
+        # Only text centred in the original box, not neighbours caught by the padding
+        inside = [b for b in found if rx0 <= _centre(b["box"])[0] <= rx1 and ry0 <= _centre(b["box"])[1] <= ry1]
+        if not inside:
+            continue
+        inside.sort(key=lambda b: _centre(b["box"])[0])
+        score = min(b["score"] for b in inside)
+        if score > boxes[i]["score"]:
+            boxes[i] = {**boxes[i], "text": " ".join(b["text"] for b in inside), "score": score}
+            improved += 1
+
+    print(f"🔍 Page {page_no}: re-read {len(regions)} low-confidence region(s) at {OCR_HIGH_DPI} dpi, "
+          f"{improved} improved ({(time.perf_counter() - start) * 1000:.0f}ms)")
+    return boxes
+
+
+# ================= LLM ================= #
+
+LINE_ITEM_STRUCTURE = """{{
+      "product_id": "",
+      "product_identifier_raw": "",
+      "product_identifier_type": "",
+      "description": "",
+      "unit": "",
+      "quantity": "",
+      "unit_price": "",
+      "line_total": ""
+    }}"""
+
+HEADER_STRUCTURE = """"po_number": "",
   "po_date": "",
   "buyer": {{
     "company_name": "",
@@ -126,68 +334,371 @@ RETURN JSON IN THIS EXACT STRUCTURE:
     "address": ""
   }},
   "currency": "",
-  "total_amount": "",
-  "line_items": [
-    {{
-      "product_id": "",
-      "product_identifier_raw": "",
-      "product_identifier_type": "",
-      "description": "",
-      "unit": "",
-      "quantity": "",
-      "unit_price": "",
-      "line_total": ""
-    }}
-  ]
-}}
+  "total_amount": \"\""""
 
-FIELD GUIDELINES:
+FIELD_GUIDELINES = """FIELD GUIDELINES:
 - product_id: internal identifier if present, else empty
 - product_identifier_raw: vendor-provided code, SAC/HSN, or combined text
 - product_identifier_type: classify raw identifier (e.g. HSN/SAC, SKU, Service Description)
 - quantity: numeric quantity only
 - unit_price, line_total, total_amount: numeric only
-- currency: ISO code like INR, USD
+- currency: ISO code like INR, USD"""
+
+CRITICAL_RULES = """CRITICAL RULES:
+- Return ONLY valid JSON
+- Do NOT hallucinate values
+- If a field is missing, return empty string ""
+- Do NOT mix fields (dates must not appear as quantity)
+- Monetary fields must contain ONLY numbers (no commas, no currency symbols)
+- Preserve vendor text in raw fields"""
+
+PO_PROMPT = """
+You are extracting structured Purchase Order data from noisy OCR text.
+
+""" + CRITICAL_RULES + """
+
+RETURN JSON IN THIS EXACT STRUCTURE:
+
+{{
+  """ + HEADER_STRUCTURE + """,
+  "line_items": [
+    """ + LINE_ITEM_STRUCTURE + """
+  ]
+}}
+
+""" + FIELD_GUIDELINES + """
 
 OCR TEXT:
-{text[:4500]}
+{text}
 """
 
-    response = requests.post(
-        OLLAMA_URL,
-        json={
-            "model": LLM_MODEL,
-            "prompt": prompt,
-            "stream": False,
-            "options": {"temperature": 0}
-        },
-        timeout=120
-    )
+HEADER_PROMPT = """
+You are extracting the header of a Purchase Order from noisy OCR text.
+The text is the start and the end of a long document; line items are
+extracted separately, do not list them.
+
+""" + CRITICAL_RULES + """
+
+RETURN JSON IN THIS EXACT STRUCTURE:
+
+{{
+  """ + HEADER_STRUCTURE + """
+}}
+
+""" + FIELD_GUIDELINES + """
+
+OCR TEXT:
+{text}
+"""
+
+ITEMS_PROMPT = """
+You are extracting the line items of a Purchase Order from ONE SECTION of
+noisy OCR text. The section may begin or end in the middle of the item
+table: skip rows that are cut off, and ignore headers, totals and terms.
+
+""" + CRITICAL_RULES + """
+
+RETURN JSON IN THIS EXACT STRUCTURE (empty list if the section has no items):
+
+{{
+  "line_items": [
+    """ + LINE_ITEM_STRUCTURE + """
+  ]
+}}
 
+""" + FIELD_GUIDELINES + """
+
+OCR TEXT SECTION:
+{text}
+"""
+
+
+REASK_PROMPT = """
+Some fields extracted from this Purchase Order OCR text were unreadable.
+Read ONLY these fields again from the text:
+
+{fields}
+
+""" + CRITICAL_RULES + """
+
+Return a JSON object with exactly these keys. Dates as YYYY-MM-DD, numbers
+without separators or currency symbols, GST numbers as the 15 character
+GSTIN. Use "" if the value is not in the text.
+
+OCR TEXT:
+{text}
+"""
+
+# Fields re-asked per document; anything beyond stays empty
+MAX_REASK_FIELDS = 20
+
+
+def _llm_json(prompt, schema):
+    """
+    One constrained call (Ollama format=schema). Malformed output is
+    repaired where possible and asked for once more before giving up.
+    """
+    for attempt in range(2):
+        # Streamed; stops reading as soon as the JSON object is closed
+        raw = llm_client.generate(
+            prompt,
+            LLM_MODEL,
+            options={"temperature": 0},
+            timeout=120,
+            stop_at_json=True,
+            response_format=schema
+        )
+        data = po_schema.parse_json(raw)
+        if isinstance(data, dict):
+            return data
+        print("⚠️ LLM returned malformed JSON" + (", asking again" if attempt == 0 else ""))
+    raise ValueError("LLM returned malformed JSON twice")
+
+
+def _reask_context(text, data, paths):
+    """The part of the OCR text the invalid fields are in, within one prompt's budget."""
+    if len(text) <= LLM_CHUNK_CHARS:
+        return text
+
+    head = LLM_CHUNK_CHARS - LLM_HEADER_TAIL_CHARS
+    if not any(p.startswith("line_items.") for p in paths):
+        return text[:head] + "\n[...]\n" + text[-LLM_HEADER_TAIL_CHARS:]
+
+    # Windows around the affected items' descriptions
+    windows = []
+    lower = text.lower()
+    for p in paths:
+        if not p.startswith("line_items."):
+            continue
+        item = data["line_items"][int(p.split(".")[1])]
+        pos = lower.find((item["description"] or item["product_identifier_raw"]).lower()[:40])
+        if pos != -1:
+            windows.append(text[max(0, pos - 300):pos + 600])
+    context = "\n[...]\n".join(dict.fromkeys(windows))
+    return context[:LLM_CHUNK_CHARS] or text[:LLM_CHUNK_CHARS]
+
+
+def reask_invalid_fields(text, data, invalid):
+    """Ask the model for just the fields validation rejected, reusing the OCR text."""
+    paths = invalid[:MAX_REASK_FIELDS]
+    described = []
+    for p in paths:
+        if p.startswith("line_items."):
+            _, i, field = p.split(".")
+            item = data["line_items"][int(i)]
+            described.append(f'- {p}: {field} of the line item "{item["description"] or item["product_identifier_raw"]}"')
+        else:
+            described.append(f"- {p}")
+
+    print(f"🔁 Re-asking {len(paths)} invalid field(s): {', '.join(paths)}")
     try:
-        data = response.json()
-        print(f"DEBUG: Ollama response keys: {data.keys()}")
-        raw = data["response"]
+        answer = _llm_json(
+            REASK_PROMPT.format(fields="\n".join(described), text=_reask_context(text, data, paths)),
+            po_schema.fields_schema(paths)
+        )
     except Exception as e:
-        print(f"DEBUG: Failed to parse Ollama response: {response.text}")
-        raise e
-    return json.loads(raw[raw.find("{"): raw.rfind("}") + 1])
+        print(f"⚠️ Re-ask failed, leaving fields empty: {e}")
+        return data
+
+    for p in paths:
+        if p in answer:
+            po_schema.set_path(data, p, answer[p])
+
+    data, still_invalid = po_schema.validate_po(data)
+    if still_invalid:
+        print(f"⚠️ Still invalid after re-ask (left empty): {', '.join(still_invalid)}")
+    return data
+
+
+def extract_po_with_llm(text):
+    if len(text) <= LLM_CHUNK_CHARS:
+        data = _llm_json(PO_PROMPT.format(text=text), po_schema.PO_SCHEMA)
+    else:
+        data = extract_po_chunked(text)
+
+    # Normalise values; re-ask only what can't be repaired instead of
+    # failing the document (which would redo OCR from scratch)
+    data, invalid = po_schema.validate_po(data)
+    if invalid:
+        data = reask_invalid_fields(text, data, invalid)
+    return data
+
+# ================= CHUNKED LLM (long POs) ================= #
+
+def split_into_chunks(text, size=None, overlap=None):
+    """
+    Split on line boundaries into chunks of at most ~size characters; each
+    chunk repeats the last ~overlap characters of the previous one so a row
+    cut at a boundary is complete in at least one chunk.
+    Returns [(chunk_text, overlap_text_with_previous)].
+    """
+    size = size or LLM_CHUNK_CHARS
+    overlap = LLM_CHUNK_OVERLAP if overlap is None else overlap
+
+    chunks = []
+    current, length, carried = [], 0, ""
+    for line in text.splitlines():
+        if current and length + len(line) + 1 > size:
+            chunks.append(("\n".join(current), carried))
+            tail, tail_len = [], 0
+            for prev in reversed(current):
+                if tail_len + len(prev) + 1 > overlap:
+                    break
+                tail.insert(0, prev)
+                tail_len += len(prev) + 1
+            carried = "\n".join(tail)
+            current, length = list(tail), tail_len
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        chunks.append(("\n".join(current), carried))
+    return chunks
+
+
+def _item_key(item):
+    return tuple(
+        " ".join(str(item.get(k, "")).lower().split())
+        for k in ("product_identifier_raw", "description", "quantity", "unit_price")
+    )
+
+
+def merge_line_items(chunk_items, chunks):
+    """
+    Concatenate per-chunk items in document order. An item is dropped as an
+    overlap duplicate only if the previous chunk returned the same item and
+    it appears in the text both chunks share - real repeated rows elsewhere
+    in the PO are kept.
+    """
+    merged = []
+    prev_keys = set()
+    for items, (_, overlap_text) in zip(chunk_items, chunks):
+        shared = overlap_text.lower()
+        keys = set()
+        for item in items:
+            key = _item_key(item)
+            keys.add(key)
+            marker = key[0] or key[1]
+            if key in prev_keys and marker and marker in shared:
+                continue
+            merged.append(item)
+        prev_keys = keys
+    return merged
+
+
+def extract_po_chunked(text):
+    """Header once (start + end of the document), line items per overlapping chunk, concurrently."""
+    chunks = split_into_chunks(text)
+    head = LLM_CHUNK_CHARS - LLM_HEADER_TAIL_CHARS
+    header_text = text[:head] + "\n[...]\n" + text[-LLM_HEADER_TAIL_CHARS:]
+    print(f"✂️ Long PO ({len(text)} chars): header + {len(chunks)} line item chunk(s)")
+
+    def items_of(chunk):
+        try:
+            items = _llm_json(ITEMS_PROMPT.format(text=chunk[0]), po_schema.ITEMS_SCHEMA).get("line_items")
+            return [i for i in items if isinstance(i, dict)] if isinstance(items, list) else []
+        except ValueError as e:
+            print(f"⚠️ Line item chunk returned invalid JSON: {e}")
+            return []
+
+    # llm_client's semaphore bounds how many of these actually run at once
+    with ThreadPoolExecutor(max_workers=llm_client.LLM_MAX_CONCURRENCY) as pool:
+        header_future = pool.submit(_llm_json, HEADER_PROMPT.format(text=header_text), po_schema.HEADER_SCHEMA)
+        chunk_items = list(pool.map(items_of, chunks))
+        data = header_future.result()
+
+    data.pop("line_items", None)
+    data["line_items"] = merge_line_items(chunk_items, chunks)
+    return data
 
 
 # ================= MAIN WORKER ================= #
 
 def run_ocr(file_name):
-    manifest = load_manifest()
-
-    if file_name not in manifest:
+    src = os.path.join(INCOMING, file_name)
+    if not os.path.exists(src):
         return
 
-    if manifest[file_name]["status"] != "pending":
+    # pending -> processing; None if unknown or another worker got it first
+    entry = claim_entry(file_name)
+    if not entry:
         return
 
+    process_entry(entry)
+
+
+def run_next_pending():
+    """Claim and process the oldest pending file. Returns False if there was none."""
+    entry = claim_next_pending()
+    if not entry:
+        return False
+
+    if not os.path.exists(os.path.join(INCOMING, entry["file_name"])):
+        mark_failed(entry["file_name"], "File not found in incoming/")
+        return True
+
+    process_entry(entry)
+    return True
+
+
+def get_text_and_layout(pdf_path, file_hash):
+    """OCR text + page model, from the cache when this file was seen before."""
+    text_variant = f"-t{TEXT_VERSION}-p{PDF_MAX_PAGES}-c{MIN_PAGE_TEXT_CHARS}-d{OCR_DPI}-{image_preprocess.signature()}"
+    if OCR_ADAPTIVE_DPI:
+        text_variant += f"-a{OCR_HIGH_DPI}@{OCR_RECHECK_SCORE}"
+
+    text = extraction_cache.get_text(file_hash, text_variant)
+    pages = extraction_cache.get_layout(file_hash, text_variant)
+    if text is not None and pages is not None:
+        print("♻️ OCR text cache hit")
+    else:
+        text, pages = extract_layout_from_pdf(pdf_path)
+        extraction_cache.put_text(file_hash, text, text_variant)
+        extraction_cache.put_layout(file_hash, pages, text_variant)
+    print(f"OCR text length: {len(text)}")
+    return text, pages
+
+
+def extract_with_llm_cached(text, file_hash):
+    extracted_data = extraction_cache.get_extraction(file_hash, LLM_MODEL, PROMPT_VERSION, text)
+    if extracted_data is not None:
+        print("♻️ LLM extraction cache hit")
+    else:
+        extracted_data = extract_po_with_llm(text)
+        extraction_cache.put_extraction(file_hash, LLM_MODEL, PROMPT_VERSION, text, extracted_data)
+    return extracted_data
+
+
+def write_layout(json_name, file_name, pages):
+    """Page model next to the PO JSON: processed_json/layout/<name>.json"""
+    os.makedirs(LAYOUT_OUTPUT, exist_ok=True)
+    with open(os.path.join(LAYOUT_OUTPUT, json_name), "w") as f:
+        json.dump({"file_name": file_name, "pages": pages}, f)
+
+
+def _heartbeat(file_name, done):
+    while not done.wait(CLAIM_HEARTBEAT):
+        try:
+            touch_claim(file_name)
+        except Exception as e:
+            print(f"⚠️ Claim heartbeat failed for {file_name}: {e}")
+
+
+def process_entry(entry):
+    """
+    OCR + LLM + insert for an entry already claimed (status 'processing').
+    A heartbeat thread keeps the claim fresh however long the PO takes.
+    """
+    done = threading.Event()
+    threading.Thread(target=_heartbeat, args=(entry["file_name"], done), daemon=True).start()
+    try:
+        _process_entry(entry)
+    finally:
+        done.set()
+
+
+def _process_entry(entry):
+    file_name = entry["file_name"]
     src = os.path.join(INCOMING, file_name)
-    if not os.path.exists(src):
-        return
 
     print(f"OCR started for: {file_name}")
 
@@ -205,15 +716,53 @@ def run_ocr(file_name):
         if actual_pdf_name != file_name:
             print(f"🔄 File converted to: {actual_pdf_name}")
         
-        text = extract_text_from_pdf(pdf_path)
-        print(f"OCR text length: {len(text)}")
-
-        extracted_data = extract_po_with_llm(text)
+        # Cache key is the received bytes, so re-sent / retried POs skip OCR and LLM
+        file_hash = extraction_cache.file_sha256(proc)
+
+        from_email = (entry["email_metadata"] or {}).get("from_email")
+        layout = None
+        if rule_parser.RULE_PARSER_ENABLED or layout_templates.TEMPLATES_ENABLED:
+            layout = rule_parser.read_layout(pdf_path, PDF_MAX_PAGES)
+
+        # Fast paths for digital POs, neither needs OCR or the LLM:
+        # 1. the sender's learned layout template  2. generic rules
+        extracted_data, confidence, method = None, 0.0, None
+        pages = None
+        if layout is not None and layout_templates.TEMPLATES_ENABLED:
+            data, confidence = layout_templates.extract(from_email, layout)
+            if data is not None and confidence >= layout_templates.TEMPLATE_MIN_CONFIDENCE:
+                print(f"⚡ Layout template extraction (confidence {confidence:.2f}), skipping LLM")
+                extracted_data, method = data, "template"
+
+        if method is None and layout is not None and rule_parser.RULE_PARSER_ENABLED:
+            data, confidence = rule_parser.parse_layout(layout)
+            if confidence >= rule_parser.RULE_PARSER_MIN_CONFIDENCE:
+                print(f"⚡ Rule parser extraction (confidence {confidence:.2f}), skipping LLM")
+                extracted_data, method = data, "rules"
+            else:
+                print(f"Rule parser confidence {confidence:.2f} too low")
+
+        if method is None:
+            text, pages = get_text_and_layout(pdf_path, file_hash)
+
+            # Scanned pages: rows/columns recovered from OCR boxes give the
+            # rule parser real tables to work with
+            if rule_parser.RULE_PARSER_ENABLED and any(p["source"] == "ocr" for p in pages):
+                data, confidence = rule_parser.parse_layout({"texts": [text], "tables": page_layout.tables(pages)})
+                if confidence >= rule_parser.RULE_PARSER_MIN_CONFIDENCE:
+                    print(f"⚡ Rule parser extraction from OCR layout (confidence {confidence:.2f}), skipping LLM")
+                    extracted_data, method = data, "rules"
+
+        if method is None:
+            extracted_data = extract_with_llm_cached(text, file_hash)
+            method = "llm"
 
         final_json = {
             "file_name": file_name,
-            "email_metadata": manifest[file_name].get("email_metadata", {}),
-            "llm_model": LLM_MODEL,
+            "email_metadata": entry["email_metadata"],
+            "llm_model": LLM_MODEL if method == "llm" else None,
+            "extraction_method": method,
+            "extraction_confidence": confidence if method != "llm" else None,
             "extracted_data": extracted_data
         }
 
@@ -221,19 +770,28 @@ def run_ocr(file_name):
         with open(os.path.join(OUTPUT, json_name), "w") as f:
             json.dump(final_json, f, indent=2)
 
+        if pages is None and layout is not None:
+            pages = page_layout.pages_from_pdf_layout(layout)
+        if pages:
+            write_layout(json_name, file_name, pages)
+
         insert_po(final_json)
 
-        manifest[file_name]["status"] = "processed"
-        manifest[file_name]["json"] = json_name
-        save_manifest(manifest)
+        mark_processed(file_name, json_name)
+
+        # Learn from rules / LLM results so the sender's next PO takes the template path
+        if layout is not None and layout_templates.TEMPLATES_ENABLED and method != "template":
+            try:
+                layout_templates.learn(from_email, layout, extracted_data)
+            except Exception as e:
+                print(f"⚠️ Layout template not learned: {e}")
 
         print(f"OCR completed successfully: {file_name}")
 
     except Exception as e:
         print(f"OCR failed for {file_name}: {e}")
 
-        manifest[file_name]["status"] = "failed"
-        manifest[file_name]["error"] = str(e)
-        save_manifest(manifest)
+        mark_failed(file_name, e)
 
-        shutil.move(proc, os.path.join(FAILED, file_name))
\ No newline at end of file
+        if os.path.exists(proc):
+            shutil.move(proc, os.path.join(FAILED, file_name))
\ No newline at end of file
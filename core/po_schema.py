@@ -0,0 +1,260 @@
+import re
+import json
+from datetime import date
+from dateutil import parser as date_parser
+
+# ============================================================
+# PO EXTRACTION SCHEMA + VALIDATION
+# ============================================================
+# The JSON structure every extractor (LLM, rule parser, layout templates)
+# returns. The schemas below are passed to Ollama as "format" so decoding
+# is constrained to it; validate_po() then normalises values and reports
+# the fields it could not repair, so only those are asked for again.
+
+BUYER_FIELDS = ("company_name", "gst_number", "address", "email")
+SELLER_FIELDS = ("company_name", "gst_number", "address")
+LINE_ITEM_FIELDS = (
+    "product_id", "product_identifier_raw", "product_identifier_type",
+    "description", "unit", "quantity", "unit_price", "line_total"
+)
+NUMERIC_ITEM_FIELDS = ("quantity", "unit_price", "line_total")
+
+GSTIN_RE = re.compile(r"^\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]$")
+EMAIL_RE = re.compile(r"^[\w.+-]+@[\w-]+\.[\w.-]+$")
+CURRENCY_ALIASES = {"₹": "INR", "RS": "INR", "RS.": "INR", "RUPEES": "INR", "$": "USD", "€": "EUR", "£": "GBP"}
+
+
+def _string():
+    return {"type": "string"}
+
+
+def _object(fields):
+    return {
+        "type": "object",
+        "properties": {f: _string() for f in fields},
+        "required": list(fields)
+    }
+
+
+LINE_ITEM_SCHEMA = _object(LINE_ITEM_FIELDS)
+
+HEADER_PROPERTIES = {
+    "po_number": _string(),
+    "po_date": _string(),
+    "buyer": _object(BUYER_FIELDS),
+    "seller": _object(SELLER_FIELDS),
+    "currency": _string(),
+    "total_amount": _string()
+}
+
+HEADER_SCHEMA = {
+    "type": "object",
+    "properties": HEADER_PROPERTIES,
+    "required": list(HEADER_PROPERTIES)
+}
+
+ITEMS_SCHEMA = {
+    "type": "object",
+    "properties": {"line_items": {"type": "array", "items": LINE_ITEM_SCHEMA}},
+    "required": ["line_items"]
+}
+
+PO_SCHEMA = {
+    "type": "object",
+    "properties": {**HEADER_PROPERTIES, "line_items": ITEMS_SCHEMA["properties"]["line_items"]},
+    "required": list(HEADER_PROPERTIES) + ["line_items"]
+}
+
+
+def fields_schema(paths):
+    """Flat schema for re-asking individual fields, e.g. 'po_date', 'line_items.2.quantity'."""
+    return _object(paths)
+
+
+def empty_po():
+    return {
+        "po_number": "",
+        "po_date": "",
+        "buyer": {f: "" for f in BUYER_FIELDS},
+        "seller": {f: "" for f in SELLER_FIELDS},
+        "currency": "",
+        "total_amount": "",
+        "line_items": []
+    }
+
+# ============================================================
+# VALUE NORMALISATION
+# ============================================================
+
+def to_number(val):
+    """'1,23,456.00 INR' -> '123456.00'; '' if there is no number."""
+    if val is None:
+        return ""
+    m = re.search(r"-?\d[\d,]*(?:\.\d+)?", str(val))
+    return m.group(0).replace(",", "") if m else ""
+
+
+YEAR_FIRST_RE = re.compile(r"^\s*\d{4}[\-/.]")
+# Leading dd/mm/yyyy only: a time or weekday after it ('05-01-2026 10:30') is still day first
+NUMERIC_DATE_RE = re.compile(r"^\s*\d{1,2}[\-/.]\d{1,2}[\-/.]\d{2,4}(?!\d)")
+
+
+def normalize_date(val):
+    """
+    -> 'YYYY-MM-DD', '' if unparseable. ISO and other year-first dates are
+    read year-month-day; only numeric dd/mm/yyyy is read day first (Indian
+    POs), so '2026-01-05' stays 5 January.
+    """
+    if not isinstance(val, str) or not val.strip():
+        return ""
+    text = val.strip()
+    try:
+        return date.fromisoformat(text[:10]).isoformat()
+    except ValueError:
+        pass
+
+    try:
+        if YEAR_FIRST_RE.match(text):
+            parsed = date_parser.parse(text, yearfirst=True, dayfirst=False, fuzzy=True)
+        else:
+            parsed = date_parser.parse(text, dayfirst=bool(NUMERIC_DATE_RE.match(text)), fuzzy=True)
+        return parsed.strftime("%Y-%m-%d")
+    except (ValueError, OverflowError, TypeError):
+        return ""
+
+
+def _str(val):
+    if val is None:
+        return ""
+    if isinstance(val, (int, float)) and not isinstance(val, bool):
+        return repr(val) if isinstance(val, float) else str(val)
+    if isinstance(val, str):
+        return " ".join(val.split())
+    return ""
+
+
+def parse_json(raw):
+    """
+    json.loads for model output, tolerating text around the object,
+    trailing commas and truncation (unclosed strings / brackets).
+    Returns None if nothing usable is left.
+    """
+    start = raw.find("{")
+    if start == -1:
+        return None
+    body = raw[start:]
+    try:
+        return json.loads(body[:body.rfind("}") + 1])
+    except ValueError:
+        pass
+
+    body = re.sub(r",\s*([}\]])", r"\1", body)
+    stack, in_string, escape = [], False, False
+    for ch in body:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+
+    if in_string:
+        body += '"'
+    body = body.rstrip().rstrip(",")
+    if body.endswith(":"):
+        body += '""'
+    body += "".join(reversed(stack))
+    try:
+        return json.loads(body)
+    except ValueError:
+        return None
+
+# ============================================================
+# VALIDATION
+# ============================================================
+
+def validate_po(data):
+    """
+    Returns (clean, invalid). clean always has the full structure with
+    normalised string values; invalid lists the dotted paths whose value
+    was present but unusable (those are left empty in clean).
+    """
+    clean = empty_po()
+    invalid = []
+    if not isinstance(data, dict):
+        return clean, invalid
+
+    clean["po_number"] = _str(data.get("po_number")).strip(" :#")
+
+    raw_date = _str(data.get("po_date"))
+    if raw_date:
+        clean["po_date"] = normalize_date(raw_date)
+        if not clean["po_date"]:
+            invalid.append("po_date")
+
+    for party, fields in (("buyer", BUYER_FIELDS), ("seller", SELLER_FIELDS)):
+        src = data.get(party) if isinstance(data.get(party), dict) else {}
+        for f in fields:
+            clean[party][f] = _str(src.get(f))
+
+        gst = clean[party]["gst_number"].replace(" ", "").upper()
+        clean[party]["gst_number"] = gst
+        if gst and not GSTIN_RE.match(gst):
+            clean[party]["gst_number"] = ""
+            invalid.append(f"{party}.gst_number")
+
+    email = clean["buyer"]["email"]
+    if email and not EMAIL_RE.match(email):
+        clean["buyer"]["email"] = ""
+        invalid.append("buyer.email")
+
+    currency = _str(data.get("currency")).upper()
+    currency = CURRENCY_ALIASES.get(currency, currency)
+    if currency and not re.match(r"^[A-Z]{3}$", currency):
+        currency = ""
+        invalid.append("currency")
+    clean["currency"] = currency
+
+    raw_total = _str(data.get("total_amount"))
+    clean["total_amount"] = to_number(raw_total)
+    if raw_total and not clean["total_amount"]:
+        invalid.append("total_amount")
+
+    items = data.get("line_items") if isinstance(data.get("line_items"), list) else []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        row = {f: _str(item.get(f)) for f in LINE_ITEM_FIELDS}
+        # Models often echo the empty example row from the prompt
+        if not (row["description"] or row["product_identifier_raw"] or row["quantity"]):
+            continue
+
+        i = len(clean["line_items"])
+        for f in NUMERIC_ITEM_FIELDS:
+            raw = row[f]
+            row[f] = to_number(raw)
+            if raw and not row[f]:
+                invalid.append(f"line_items.{i}.{f}")
+        clean["line_items"].append(row)
+
+    return clean, invalid
+
+
+def get_path(data, path):
+    for part in path.split("."):
+        data = data[int(part)] if isinstance(data, list) else data[part]
+    return data
+
+
+def set_path(data, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        data = data[int(part)] if isinstance(data, list) else data[part]
+    data[parts[-1]] = value
@@ -0,0 +1,307 @@
+import os
+import re
+import pdfplumber
+
+from core.po_schema import empty_po, to_number, normalize_date
+
+# ============================================================
+# RULE-BASED PO EXTRACTION (fast path before the LLM)
+# ============================================================
+# Fills the same JSON structure as extract_po_with_llm from a digital
+# PDF's text layer and tables. Returns a confidence score; the OCR worker
+# only skips the LLM when the score clears RULE_PARSER_MIN_CONFIDENCE.
+
+RULE_PARSER_ENABLED = os.getenv("RULE_PARSER", "1") == "1"
+RULE_PARSER_MIN_CONFIDENCE = float(os.getenv("RULE_PARSER_MIN_CONFIDENCE", "0.8"))
+
+PO_NUMBER_RE = re.compile(
+    r"(?:P\.?\s?O\.?|Purchase\s+Order|Order)\s*(?:No\.?|Number|Num|#)\s*[:\-.]?\s*([A-Z0-9][A-Z0-9\-/_.]{2,})",
+    re.IGNORECASE
+)
+DATE_RE = re.compile(
+    r"(?:P\.?\s?O\.?\s*|Order\s*)?Date[d]?\s*[:\-.]?\s*"
+    r"(\d{4}-\d{2}-\d{2}|\d{1,2}[\-/.]\d{1,2}[\-/.]\d{2,4}|\d{1,2}[\s\-][A-Za-z]{3,9}[\s\-,]+\d{2,4}|[A-Za-z]{3,9}\s+\d{1,2},?\s+\d{4})",
+    re.IGNORECASE
+)
+GSTIN_RE = re.compile(r"\b\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]\b")
+EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+TOTAL_RE = re.compile(
+    r"(?:Grand\s+Total|Total\s+Amount|Net\s+Amount|Total\s+Value|Total)\s*(?:\([^)]*\))?\s*[:\-]?\s*"
+    r"(?:INR|Rs\.?|₹|USD|\$)?\s*([\d,]+(?:\.\d+)?)",
+    re.IGNORECASE
+)
+
+BUYER_LABELS = ("bill to", "buyer", "invoice to", "purchaser", "ship to")
+SELLER_LABELS = ("vendor", "supplier", "seller")
+# Words after a party label: 'Buyer Name:' / 'Supplier Details' still head
+# the party block, 'Vendor Code:' / 'Buyer GSTIN:' are single fields
+LABEL_NAME_SUFFIXES = ("name", "details", "detail", "information", "info")
+LABEL_FIELD_SUFFIXES = ("code", "id", "no", "number", "gstin", "gst", "email", "address", "phone", "contact", "ref")
+FIELD_LINE_RE = re.compile(
+    r"^(?:gstin|gst|pan|e-?mail|phone|tel|mobile|contact|address|state|code|attn)\b",
+    re.IGNORECASE
+)
+NAME_PREFIX_RE = re.compile(r"^\s*(?:company\s+)?name\s*[:\-]\s*", re.IGNORECASE)
+
+# Header keyword -> line item field, checked in order (so 'Unit Price' is
+# a price, not a unit, and 'Product ID' an identifier, not a description)
+COLUMN_KEYWORDS = [
+    ("product_id", ("product id", "sku", "item code", "product code", "part no", "part number")),
+    ("product_identifier_raw", ("hsn", "sac", "code")),
+    ("description", ("description", "particulars", "item", "product", "material", "service")),
+    ("quantity", ("qty", "quantity")),
+    ("unit_price", ("unit price", "rate", "price")),
+    ("unit", ("unit", "uom")),
+    ("line_total", ("amount", "total", "value")),
+]
+
+# ============================================================
+# HEADER FIELDS
+# ============================================================
+
+def _label_at(low, label):
+    """Index of label as a standalone word in a lower-cased line (not inside 'acme-seller.com'), else -1."""
+    m = re.search(rf"(?:^|(?<=\s)){re.escape(label)}\b(?![@.\-])", low)
+    return m.start() if m else -1
+
+
+def _heading(line, label):
+    """
+    Text after label if line is a party heading for it, else None. The label
+    must start the line ('Bill To', 'Supplier Details: ...') or be followed
+    by ':' ('... Seller: Acme'), so 'ACME Seller Pvt Ltd' or 'Vendor shall
+    deliver ...' never count. 'Name' / 'Details' after the label are dropped;
+    '<label> Code:' style lines are fields, not headings.
+    """
+    low = line.lower()
+    for m in re.finditer(rf"(?:^|(?<=\s)){re.escape(label)}\b(?![@.\-])", low):
+        rest = line[m.end():]
+        word = re.match(r"\s*([a-z]+)\b", rest.lower())
+        if word and word.group(1) in LABEL_FIELD_SUFFIXES:
+            continue
+        if word and word.group(1) in LABEL_NAME_SUFFIXES:
+            rest = rest[word.end():]
+
+        sep = re.match(r"\s*:", rest)
+        if sep:
+            return rest[sep.end():]
+        if not line[:m.start()].strip() and not rest.strip(" -\t"):
+            return ""
+    return None
+
+
+def _is_heading(line, labels):
+    return any(_heading(line, label) is not None for label in labels)
+
+
+def _plausible_name(value):
+    """A company name, not a field value or a leftover label word."""
+    value = value.strip()
+    if not value or len(value) > 100 or not re.search(r"[A-Za-z]", value):
+        return False
+    if ":" in value or FIELD_LINE_RE.match(value) or EMAIL_RE.search(value) or GSTIN_RE.search(value):
+        return False
+    low = value.lower()
+    return low not in BUYER_LABELS + SELLER_LABELS + LABEL_NAME_SUFFIXES
+
+
+def _party_block(lines, labels, stop_labels=()):
+    """
+    Company name, GSTIN and email from a heading like 'Bill To' and the
+    lines following it, up to the next party's heading.
+    """
+    for i, line in enumerate(lines):
+        for label in labels:
+            rest = _heading(line, label)
+            if rest is None:
+                continue
+            # Side-by-side 'Buyer: ... Seller: ...' headings
+            cut = [p for p in (_label_at(rest.lower(), s) for s in stop_labels) if p != -1]
+            rest = rest[:min(cut)] if cut else rest
+            rest = rest.strip(" :-\t")
+            block = [rest] if rest else []
+            for l in lines[i + 1:i + 5]:
+                # Next party's heading ends this block
+                if _is_heading(l, stop_labels):
+                    break
+                block.append(l)
+            names = (NAME_PREFIX_RE.sub("", l).strip() for l in block)
+            name = next((n for n in names if _plausible_name(n)), "")
+            gst = next((m.group(0) for l in block for m in [GSTIN_RE.search(l)] if m), "")
+            email = next((m.group(0) for l in block for m in [EMAIL_RE.search(l)] if m), "")
+            return name, gst, email
+    return "", "", ""
+
+
+def parse_header(text):
+    data = empty_po()
+    lines = [l for l in text.splitlines() if l.strip()]
+
+    m = PO_NUMBER_RE.search(text)
+    if m:
+        data["po_number"] = m.group(1).strip(".-/")
+
+    m = DATE_RE.search(text)
+    if m:
+        data["po_date"] = normalize_date(m.group(1))
+
+    totals = TOTAL_RE.findall(text)
+    if totals:
+        # The grand total is normally the last 'Total' on the document
+        data["total_amount"] = to_number(totals[-1])
+
+    upper = text.upper()
+    if "INR" in upper or "₹" in text or "RS." in upper or "RUPEE" in upper:
+        data["currency"] = "INR"
+    elif "USD" in upper or "$" in text:
+        data["currency"] = "USD"
+
+    buyer_name, buyer_gst, buyer_email = _party_block(lines, BUYER_LABELS, SELLER_LABELS)
+    seller_name, seller_gst, _ = _party_block(lines, SELLER_LABELS, BUYER_LABELS)
+    data["buyer"]["company_name"] = buyer_name
+    data["buyer"]["gst_number"] = buyer_gst
+    data["seller"]["company_name"] = seller_name
+    data["seller"]["gst_number"] = seller_gst
+
+    # Only from the buyer block: the first address on a PO is often the
+    # seller's letterhead. Left empty, the agent replies to the sender.
+    data["buyer"]["email"] = buyer_email
+
+    return data
+
+# ============================================================
+# LINE ITEMS (from pdfplumber tables)
+# ============================================================
+
+def map_columns(header_row):
+    """Header cells -> {field: column index}. Empty if it doesn't look like an item table."""
+    mapping = {}
+    for col, cell in enumerate(header_row):
+        label = " ".join(str(cell or "").lower().split())
+        if not label:
+            continue
+        for field, keywords in COLUMN_KEYWORDS:
+            if field in mapping:
+                continue
+            if any(k in label for k in keywords):
+                mapping[field] = col
+                break
+
+    if "description" in mapping and "quantity" in mapping:
+        return mapping
+    return {}
+
+
+def rows_to_items(rows, mapping):
+    items = []
+    for row in rows:
+        def cell(field):
+            col = mapping.get(field)
+            if col is None or col >= len(row):
+                return ""
+            return " ".join(str(row[col] or "").split())
+
+        qty = to_number(cell("quantity"))
+        desc = cell("description")
+        if not qty or not desc:
+            # Sub-total / tax / blank rows
+            continue
+
+        product_id = cell("product_id")
+        raw_id = cell("product_identifier_raw") or product_id
+        items.append({
+            "product_id": product_id,
+            "product_identifier_raw": raw_id,
+            "product_identifier_type": "HSN/SAC" if raw_id.isdigit() else ("SKU" if raw_id else ""),
+            "description": desc,
+            "unit": cell("unit"),
+            "quantity": qty,
+            "unit_price": to_number(cell("unit_price")),
+            "line_total": to_number(cell("line_total"))
+        })
+    return items
+
+
+def parse_tables(tables):
+    items = []
+    for table in tables:
+        for h, header in enumerate(table[:3]):
+            mapping = map_columns(header)
+            if mapping:
+                items.extend(rows_to_items(table[h + 1:], mapping))
+                break
+    return items
+
+# ============================================================
+# CONFIDENCE
+# ============================================================
+
+def score(data):
+    """0..1: how much of the extraction can be trusted without the LLM."""
+    items = data["line_items"]
+    s = 0.0
+    if data["po_number"]:
+        s += 0.25
+    if data["po_date"]:
+        s += 0.1
+    # Template 'static' values skip parse_header: check them here as well
+    if _plausible_name(data["buyer"]["company_name"] or "") or data["buyer"]["gst_number"]:
+        s += 0.1
+    if items:
+        s += 0.3
+        if all(i["unit_price"] or i["line_total"] for i in items):
+            s += 0.1
+
+    try:
+        total = float(data["total_amount"])
+        line_sum = sum(float(i["line_total"]) for i in items if i["line_total"])
+        # Totals often include GST; accept pre-tax or common tax-inclusive sums
+        if line_sum and any(abs(total - line_sum * f) <= max(1.0, total * 0.005) for f in (1.0, 1.05, 1.12, 1.18, 1.28)):
+            s += 0.15
+    except ValueError:
+        pass
+
+    # Without product ids the agent can't allocate stock: never skip the LLM
+    if items and not all(i["product_id"] for i in items):
+        s = min(s, 0.5)
+    return round(min(s, 1.0), 2)
+
+
+def read_layout(pdf_path, max_pages=10):
+    """
+    Text, tables and positioned words of a digital PDF, read in one pass.
+    None if there is no usable text layer (scans go to OCR + LLM).
+    """
+    try:
+        with pdfplumber.open(pdf_path) as pdf:
+            pages = pdf.pages[:max_pages] if max_pages else pdf.pages
+            texts = [p.extract_text() or "" for p in pages]
+            if sum(len(t.strip()) for t in texts) < 100:
+                return None
+            return {
+                "texts": texts,
+                "tables": [t for p in pages for t in p.extract_tables()],
+                "words": [p.extract_words(keep_blank_chars=False) for p in pages],
+                "sizes": [(float(p.width), float(p.height)) for p in pages]
+            }
+    except Exception as e:
+        print(f"⚠️ Rule parser could not read PDF: {e}")
+        return None
+
+
+def parse_layout(layout):
+    """Returns (extracted_data, confidence)."""
+    data = parse_header("\n".join(layout["texts"]))
+    data["line_items"] = parse_tables(layout["tables"])
+    return data, score(data)
+
+
+def parse_po(pdf_path, max_pages=10):
+    """
+    Returns (extracted_data, confidence). confidence is 0 for PDFs without
+    a usable text layer, which always go to OCR + LLM.
+    """
+    layout = read_layout(pdf_path, max_pages)
+    if layout is None:
+        return None, 0.0
+    return parse_layout(layout)
@@ -100,6 +100,9 @@ def run_pipeline():
         if service == 'ocr' or service == 'full':
             run_service([sys.executable, 'services/po_ocr_worker_service.py'], "OCR Worker")
 
+        if service == 'agent' or service == 'full':
+            run_service([sys.executable, 'services/agent_worker_service.py'], "Agent Worker")
+
         return jsonify({"status": "success", "message": f"Pipeline ({service}) triggered in background."})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -22,10 +22,12 @@ with patch('psycopg2.connect'), \
      patch('core.optimized_agent.send_email', side_effect=print_email):
 
     from core.optimized_agent import process_po
+    from scripts.mock_allocation import patch_allocate_po
 
     # Patch data helpers
     with patch('core.optimized_agent.get_po_details') as mock_get_details, \
-         patch('core.optimized_agent.get_inventory_batch') as mock_get_stock:
+         patch('core.optimized_agent.get_inventory_batch') as mock_get_stock, \
+         patch_allocate_po(mock_get_details, mock_get_stock):
          
         # Setup Test Data
         mock_get_details.return_value = (
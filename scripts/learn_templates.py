@@ -0,0 +1,53 @@
+import os
+import sys
+import json
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core import rule_parser, layout_templates
+from core.po_ocr_worker import OUTPUT, PROCESSING, PDF_MAX_PAGES
+
+# Backfill per-sender layout templates from POs that were already processed:
+# processed_json/*.json gives the sender and the extraction, processing/
+# still holds the source PDF. Safe to re-run; templates are refreshed.
+
+
+def source_pdf(file_name):
+    for name in (file_name, os.path.splitext(file_name)[0] + ".pdf"):
+        path = os.path.join(PROCESSING, name)
+        if name.lower().endswith(".pdf") and os.path.exists(path):
+            return path
+    return None
+
+
+def backfill():
+    files = sorted(f for f in os.listdir(OUTPUT) if f.endswith(".json"))
+    print(f"📂 Found {len(files)} processed POs.")
+
+    learned = skipped = 0
+    for json_name in files:
+        with open(os.path.join(OUTPUT, json_name)) as f:
+            record = json.load(f)
+
+        from_email = (record.get("email_metadata") or {}).get("from_email")
+        pdf_path = source_pdf(record.get("file_name", ""))
+        if not from_email or not pdf_path or record.get("extraction_method") == "template":
+            skipped += 1
+            continue
+
+        layout = rule_parser.read_layout(pdf_path, PDF_MAX_PAGES)
+        try:
+            if layout_templates.learn(from_email, layout, record.get("extracted_data") or {}):
+                learned += 1
+            else:
+                skipped += 1
+        except Exception as e:
+            print(f"❌ {json_name}: {e}")
+            skipped += 1
+
+    print(f"✨ Learned {learned} template(s), skipped {skipped}.")
+
+
+if __name__ == "__main__":
+    backfill()
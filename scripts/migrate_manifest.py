@@ -0,0 +1,16 @@
+import os
+import sys
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.manifest_store import migrate_from_json, LEGACY_MANIFEST
+
+# One-time import of manifest.json into the po_manifest table.
+# Safe to re-run: entries already in the table are never overwritten.
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else LEGACY_MANIFEST
+    print(f"🔄 Migrating {path} -> po_manifest")
+    count = migrate_from_json(path)
+    print(f"✨ Imported {count} new entries.")
@@ -0,0 +1,25 @@
+from unittest.mock import patch
+
+from core.optimized_agent import reconstruct_decisions, classify_outcome
+
+# ============================================================
+# allocate_po STAND-IN FOR THE MOCKED AGENT SCRIPTS
+# ============================================================
+# debug_email_body.py, send_test_emails.py and test_email_scenarios.py
+# feed process_po canned data through patched get_po_details /
+# get_inventory_batch and never open a database transaction.
+
+
+def fake_allocate(mock_get_details, mock_get_stock):
+    """Mirrors allocate_po's decision without the locked DB transaction."""
+    header, items = mock_get_details.return_value
+    decisions = reconstruct_decisions(items, mock_get_stock.return_value)
+    return header, decisions, classify_outcome(decisions)
+
+
+def patch_allocate_po(mock_get_details, mock_get_stock):
+    """patch() for core.optimized_agent.allocate_po reading the current mock return values."""
+    return patch(
+        'core.optimized_agent.allocate_po',
+        side_effect=lambda po_id, **kw: fake_allocate(mock_get_details, mock_get_stock)
+    )
@@ -27,12 +27,14 @@ with patch('psycopg2.connect'), \
      patch('core.optimized_agent.update_po_status'):
 
     from core.optimized_agent import process_po
+    from scripts.mock_allocation import patch_allocate_po
 
     mock_gen_invoice.return_value = DUMMY_PDF
 
     # Re-patching helpers to inject scenarios
     with patch('core.optimized_agent.get_po_details') as mock_get_details, \
-         patch('core.optimized_agent.get_inventory_batch') as mock_get_stock:
+         patch('core.optimized_agent.get_inventory_batch') as mock_get_stock, \
+         patch_allocate_po(mock_get_details, mock_get_stock):
          
         # We REMOVED mock_llm_body so it uses REAL LLM (requests.post)
         # Assuming Docker container has network access to localhost:11434 (which is po_ollama in compose network)
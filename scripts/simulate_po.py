@@ -1,5 +1,4 @@
 import os
-import json
 import sys
 from datetime import datetime
 
@@ -7,9 +6,12 @@ from datetime import datetime
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 from generate_test_po import create_test_po
 
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.manifest_store import add_entry
+
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INCOMING_DIR = os.path.join(BASE_DIR, "incoming")
-MANIFEST_FILE = os.path.join(BASE_DIR, "manifest.json")
 
 def simulate():
     # Ensure directory exists
@@ -28,30 +30,15 @@ def simulate():
         print(f"❌ Failed to generate PDF: {e}")
         return
     
-    # 2. Update Manifest
-    if os.path.exists(MANIFEST_FILE):
-        try:
-            with open(MANIFEST_FILE, 'r') as f:
-                manifest = json.load(f)
-        except json.JSONDecodeError:
-             manifest = {}
-    else:
-        manifest = {}
-        
-    manifest[filename] = {
-        "status": "pending",
-        "email_metadata": {
-            "from_email": "simulation@test.com",
-            # Format expected by pipeline might vary, but let's try standard format
-            "received_at": datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000"),
-            "subject": f"Purchase Order {po_number}"
-        }
-    }
-    
-    with open(MANIFEST_FILE, 'w') as f:
-        json.dump(manifest, f, indent=2)
+    # 2. Register in Manifest Store
+    add_entry(filename, {
+        "from_email": "simulation@test.com",
+        # Format expected by pipeline might vary, but let's try standard format
+        "received_at": datetime.now().strftime("%a, %d %b %Y %H:%M:%S +0000"),
+        "subject": f"Purchase Order {po_number}"
+    })
         
-    print(f"✅ Created {filename} in incoming/ and updated manifest.json")
+    print(f"✅ Created {filename} in incoming/ and registered it in the manifest store")
     print("🚀 OCR Worker should pick this up immediately!")
 
 if __name__ == "__main__":
@@ -16,6 +16,7 @@ with patch('psycopg2.connect') as mock_connect, \
      patch('core.optimized_agent.update_po_status') as mock_update_status:
 
     from core.optimized_agent import process_po
+    from scripts.mock_allocation import patch_allocate_po
 
     # Setup Mocks
     mock_conn = mock_connect.return_value
@@ -43,7 +44,8 @@ with patch('psycopg2.connect') as mock_connect, \
 
     # Re-patching internal helpers for easier control
     with patch('core.optimized_agent.get_po_details') as mock_get_details, \
-         patch('core.optimized_agent.get_inventory_batch') as mock_get_stock:
+         patch('core.optimized_agent.get_inventory_batch') as mock_get_stock, \
+         patch_allocate_po(mock_get_details, mock_get_stock):
         
         # Setup Common Data
         mock_get_details.return_value = (
@@ -14,6 +14,7 @@ sys.path.append(os.getcwd())
 
 from config.db_config import DB_CONFIG
 import psycopg2
+from core.manifest_store import get_recent_entries
 
 # ================= CONFIG ================= #
 SMTP_SERVER = "smtp.gmail.com"
@@ -64,17 +65,12 @@ def check_db_for_po():
         return None
 
 def check_manifest():
-    manifest_path = "manifest.json"
-    if not os.path.exists(manifest_path):
-        return None
     try:
-        with open(manifest_path, "r") as f:
-            data = json.load(f)
-            # Find the entry that corresponds to our test file
-            for fname, meta in data.items():
-                if meta.get("email_metadata", {}).get("subject") == f"New Purchase Order: {PO_NUMBER}" or \
-                   meta.get("email_metadata", {}).get("from_email") == EMAIL_USER:
-                    return meta
+        # Find the entry that corresponds to our test file
+        for meta in get_recent_entries():
+            if meta.get("email_metadata", {}).get("subject") == f"New Purchase Order: {PO_NUMBER}" or \
+               meta.get("email_metadata", {}).get("from_email") == EMAIL_USER:
+                return meta
     except:
         pass
     return None
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import signal
+import threading
+from datetime import datetime
+
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.job_queue import (
+    claim_job, complete_job, fail_job, requeue_stale_jobs,
+    JOB_PROCESS_PO, JOB_PARTIAL_RESPONSE, AGENT_JOBS_CHANNEL
+)
+from core.pg_notify import Wakeup, listen_forever
+from core.optimized_agent import process_po, handle_partial_response
+from core.db_pool import close_pool, ensure_tables
+
+# ================== CONFIG ================== #
+
+AGENT_WORKERS = int(os.getenv("AGENT_WORKERS", "2"))
+# Job types handled here; customer_reply jobs belong to services/reply_listener.py
+AGENT_JOB_TYPES = (JOB_PROCESS_PO, JOB_PARTIAL_RESPONSE)
+# Workers sleep until a NOTIFY on AGENT_JOBS_CHANNEL; this fallback only
+# picks up retries whose backoff expired and anything missed by the listener
+FALLBACK_POLL = float(os.getenv("AGENT_FALLBACK_POLL", "60"))   # seconds
+ERROR_BACKOFF = 5                                               # seconds
+STALE_CHECK_INTERVAL = 60                                       # seconds
+
+# ============================================ #
+
+stop_event = threading.Event()
+wakeup = Wakeup()
+
+
+def log(msg):
+    ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"[{ts}] [{threading.current_thread().name}] {msg}", flush=True)
+
+
+def dispatch(job):
+    if job["job_type"] == JOB_PROCESS_PO:
+        process_po(job["po_id"], job_id=job["job_id"])
+    elif job["job_type"] == JOB_PARTIAL_RESPONSE:
+        handle_partial_response(job["po_id"], job["payload"].get("decision"), job_id=job["job_id"])
+    else:
+        raise ValueError(f"Unknown job type: {job['job_type']}")
+
+
+def worker_loop():
+    while not stop_event.is_set():
+        # Read the generation BEFORE claiming so a NOTIFY that lands while
+        # we find the queue empty is not lost
+        seen = wakeup.generation()
+        try:
+            job = claim_job(AGENT_JOB_TYPES)
+        except Exception as e:
+            log(f"Queue error: {e}")
+            stop_event.wait(ERROR_BACKOFF)
+            continue
+
+        if not job:
+            wakeup.wait(seen, FALLBACK_POLL)
+            continue
+
+        log(f"Job {job['job_id']} ({job['job_type']}) for PO {job['po_id']}, attempt {job['attempts']}")
+        try:
+            dispatch(job)
+            complete_job(job["job_id"])
+        except Exception as e:
+            final = fail_job(job, e)
+            log(f"Job {job['job_id']} failed{' permanently' if final else ', will retry'}: {e}")
+
+
+def run():
+    ensure_tables()
+    reclaimed = requeue_stale_jobs()
+    if reclaimed:
+        log(f"Requeued {reclaimed} stale job(s)")
+
+    # docker stop / pkill send SIGTERM: finish in-flight jobs, then exit
+    def shutdown(*_):
+        stop_event.set()
+        wakeup.signal()
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    listener = threading.Thread(
+        target=listen_forever,
+        args=([AGENT_JOBS_CHANNEL], lambda _n: wakeup.signal(), stop_event),
+        name="listener",
+        daemon=True
+    )
+    listener.start()
+
+    threads = [
+        threading.Thread(target=worker_loop, name=f"agent-{i + 1}", daemon=True)
+        for i in range(AGENT_WORKERS)
+    ]
+    for t in threads:
+        t.start()
+
+    log(f"Agent worker service started with {AGENT_WORKERS} worker(s)")
+
+    try:
+        while not stop_event.wait(STALE_CHECK_INTERVAL):
+            try:
+                reclaimed = requeue_stale_jobs()
+                if reclaimed:
+                    log(f"Requeued {reclaimed} stale job(s)")
+            except Exception as e:
+                log(f"Stale job check failed: {e}")
+    except KeyboardInterrupt:
+        shutdown()
+
+    log("Draining in-flight jobs...")
+    for t in threads:
+        t.join()
+    close_pool()
+    log("Agent worker service stopped")
+
+
+if __name__ == "__main__":
+    run()
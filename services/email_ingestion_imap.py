@@ -1,8 +1,8 @@
-import imaplib
 import email
+import io
 from email.header import decode_header
 import os
-import json
+import sys
 import uuid
 import time
 from datetime import datetime
@@ -13,6 +13,19 @@ from dotenv import load_dotenv
 # Load local environment variables
 load_dotenv()
 
+# Add project root to sys.path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.db_pool import ensure_tables
+from core.manifest_store import add_entry
+from core.imap_session import MailboxSession
+from core.imap_checkpoint import get_last_uid, save_last_uid
+from core.imap_fetch import parse_fetch, fetch_item, body_parts, fetch_part, decode_text
+from core.ingest_dedup import message_seen, record_message, claim_file, release_file
+from core.extraction_cache import file_sha256
+from core.mail_router import classify, header_text, ROUTE_REPLY
+from core.job_queue import submit_job, JOB_CUSTOMER_REPLY
+
 # ================== CONFIG ================== #
 
 IMAP_SERVER = "imap.gmail.com"
@@ -21,18 +34,22 @@ EMAIL_PASS = os.getenv("EMAIL_PASS")
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 INCOMING = os.path.join(BASE_DIR, "incoming")
+PARTIAL = os.path.join(INCOMING, ".partial")   # files being downloaded, not yet deduplicated
 LOGS = os.path.join(BASE_DIR, "logs")
-MANIFEST = os.path.join(BASE_DIR, "manifest.json")
 
 ALLOWED_EXT = (".pdf", ".docx", ".doc", ".jpg", ".jpeg", ".png")
 
-INITIAL_POLL = 5          # seconds
-MAX_POLL = 1800           # 30 minutes
+INITIAL_POLL = 5          # seconds; NOOP interval when the server has no IDLE, first reconnect delay
+MAX_POLL = 1800           # 30 minutes; reconnect backoff cap
 MIN_PO_SCORE = 3          # semantic threshold
+FETCH_BATCH = int(os.getenv("IMAP_FETCH_BATCH", "25"))   # messages per UID FETCH
+HEADER_FIELDS = "FROM DATE MESSAGE-ID SUBJECT IN-REPLY-TO REFERENCES"
+REPLY_BODY_CHARS = 5000   # of a customer reply, queued for intent classification
 
 # ============================================ #
 
 os.makedirs(INCOMING, exist_ok=True)
+os.makedirs(PARTIAL, exist_ok=True)
 os.makedirs(LOGS, exist_ok=True)
 
 
@@ -46,20 +63,6 @@ def log(msg):
         f.write(line + "\n")
 
 
-# ================== MANIFEST ================== #
-
-def load_manifest():
-    try:
-        with open(MANIFEST) as f:
-            return json.load(f)
-    except:
-        return {}
-
-def save_manifest(m):
-    with open(MANIFEST, "w") as f:
-        json.dump(m, f, indent=2)
-
-
 # ================== PO DETECTION ================== #
 
 def looks_like_po(text):
@@ -79,7 +82,8 @@ def looks_like_po(text):
 # ================== EMAIL BODY → PDF ================== #
 
 def email_body_to_pdf(text, output_path):
-    c = canvas.Canvas(output_path, pagesize=A4)
+    # invariant: same text -> same bytes, so resent body POs deduplicate by hash
+    c = canvas.Canvas(output_path, pagesize=A4, invariant=1)
     y = 800
     for line in text.splitlines():
         if line.strip():
@@ -91,129 +95,213 @@ def email_body_to_pdf(text, output_path):
     c.save()
 
 
-# ================== EMAIL POLLING ================== #
+# ================== MESSAGE INGESTION ================== #
 
-def poll_emails(poll_interval):
-    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-    mail.login(EMAIL_USER, EMAIL_PASS)
-    mail.select("INBOX")
-
-    status, msgs = mail.search(None, "UNSEEN")
-    ids = msgs[0].split()
-
-    if not ids:
-        mail.logout()
-        # Return False but keep the same polling speed (User Requirement)
-        return False, INITIAL_POLL
-
-    mail_id = ids[-1]
-    _, data = mail.fetch(mail_id, "(RFC822)")
-
-    for resp in data:
-        if not isinstance(resp, tuple):
-            continue
-
-        msg = email.message_from_bytes(resp[1])
-        from_email = msg.get("From", "")
-        received_at = msg.get("Date", "")
-
-        body_text = ""
-        attachment_saved = False
-
-        for part in msg.walk():
-            # -------- EMAIL BODY -------- #
-            if part.get_content_type() == "text/plain":
-                body_text += part.get_payload(decode=True).decode(errors="ignore")
-
-            # -------- ATTACHMENTS -------- #
-            if part.get_content_disposition() == "attachment":
-                name = part.get_filename()
-                if not name:
-                    continue
-
-                name = decode_header(name)[0][0]
-                if isinstance(name, bytes):
-                    name = name.decode()
-
-                if name.lower().endswith(ALLOWED_EXT):
-                    ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    uid = uuid.uuid4().hex[:8]
-                    ext = os.path.splitext(name)[1]
-                    fname = f"{ts}_{uid}{ext}"
-
-                    with open(os.path.join(INCOMING, fname), "wb") as f:
-                        f.write(part.get_payload(decode=True))
-
-                    manifest = load_manifest()
-                    manifest[fname] = {
-                        "status": "pending",
-                        "email_metadata": {
-                            "from_email": from_email,
-                            "received_at": received_at
-                        }
-                    }
-                    save_manifest(manifest)
-
-                    log(f"New PO attachment saved: {fname}")
-                    attachment_saved = True
-
-        # -------- EMAIL BODY AS PO -------- #
-        if not attachment_saved and looks_like_po(body_text):
+def register_file(partial_path, fname, metadata):
+    """
+    Move a fully downloaded file from incoming/.partial into incoming/ and
+    queue it, unless the same bytes were ingested before. Returns True if queued.
+    """
+    digest = file_sha256(partial_path)
+    existing = claim_file(digest, fname, metadata.get("message_id"))
+    if existing:
+        os.remove(partial_path)
+        log(f"Duplicate of {existing}, skipped")
+        return False
+
+    final_path = os.path.join(INCOMING, fname)
+    try:
+        os.replace(partial_path, final_path)
+        add_entry(fname, metadata)
+    except Exception:
+        # No manifest row: leave neither an orphan file nor a hash that blocks a resend
+        if os.path.exists(final_path):
+            os.remove(final_path)
+        release_file(digest)
+        raise
+    return True
+
+
+def attachment_name(part):
+    """Decoded filename of an attachment ingestion accepts, else None."""
+    if part["disposition"] != "attachment" or not part["filename"]:
+        return None
+
+    name = decode_header(part["filename"])[0][0]
+    if isinstance(name, bytes):
+        name = name.decode()
+    return name if name.lower().endswith(ALLOWED_EXT) else None
+
+
+def plain_text(mail, uid, parts):
+    text = ""
+    for part in parts:
+        if part["type"] == "text/plain":
+            buf = io.BytesIO()
+            fetch_part(mail, uid, part, buf)
+            text += decode_text(buf.getvalue(), part["charset"])
+    return text
+
+
+def ingest_message(mail, uid, parts, metadata):
+    """
+    Save the allowed attachments of one message (or its body as a PDF when
+    it reads like a PO). Only the parts needed are downloaded, and files
+    already ingested are skipped. Returns True if the message held a PO.
+    """
+    body_text = plain_text(mail, uid, parts)
+    attachment_saved = False
+
+    for part in parts:
+        # -------- ATTACHMENTS -------- #
+        name = attachment_name(part)
+        if name:
             ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-            uid = uuid.uuid4().hex[:8]
-            fname = f"{ts}_{uid}_email_body.pdf"
-            pdf_path = os.path.join(INCOMING, fname)
-
-            email_body_to_pdf(body_text, pdf_path)
-
-            manifest = load_manifest()
-            manifest[fname] = {
-                "status": "pending",
-                "email_metadata": {
-                    "from_email": from_email,
-                    "received_at": received_at
-                }
-            }
-            save_manifest(manifest)
+            file_uid = uuid.uuid4().hex[:8]
+            ext = os.path.splitext(name)[1]
+            fname = f"{ts}_{file_uid}{ext}"
+            partial_path = os.path.join(PARTIAL, fname)
+
+            with open(partial_path, "wb") as f:
+                fetch_part(mail, uid, part, f)
+
+            if register_file(partial_path, fname, metadata):
+                log(f"New PO attachment saved: {fname}")
+            # A duplicate attachment still means the body is not the PO
+            attachment_saved = True
 
+    # -------- EMAIL BODY AS PO -------- #
+    if not attachment_saved and looks_like_po(body_text):
+        ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+        file_uid = uuid.uuid4().hex[:8]
+        fname = f"{ts}_{file_uid}_email_body.pdf"
+        partial_path = os.path.join(PARTIAL, fname)
+
+        email_body_to_pdf(body_text, partial_path)
+
+        if register_file(partial_path, fname, metadata):
             log(f"PO detected in email body, saved as: {fname}")
+        return True
+
+    return attachment_saved
+
+
+def queue_reply(mail, uid, parts, metadata, po_id):
+    body = plain_text(mail, uid, parts)
+    job_id = submit_job(JOB_CUSTOMER_REPLY, po_id, {
+        "from_email": metadata["from_email"],
+        "subject": metadata["subject"],
+        "message_id": metadata["message_id"],
+        "body": body[:REPLY_BODY_CHARS]
+    })
+    log(f"Reply to PO {po_id} queued for the reply listener (job {job_id})")
 
-        mail.store(mail_id, "+FLAGS", "\\Seen")
-        mail.logout()
-        return True, INITIAL_POLL
 
-    mail.logout()
-    return False, INITIAL_POLL
+def route_message(mail, uid, headers, parts):
+    """Classify one message from its headers and hand it to the right consumer."""
+    message_id = (headers.get("Message-ID") or "").strip()
+    if message_seen(message_id):
+        log(f"Message {message_id} already ingested, skipped")
+        return
+
+    metadata = {
+        "from_email": headers.get("From", ""),
+        "received_at": headers.get("Date", ""),
+        "message_id": message_id,
+        "subject": header_text(headers.get("Subject"))
+    }
+
+    route, po_id = classify(headers, any(attachment_name(p) for p in parts))
+    if route == ROUTE_REPLY:
+        queue_reply(mail, uid, parts, metadata, po_id)
+    elif not ingest_message(mail, uid, parts, metadata):
+        log(f"No PO in message '{metadata['subject']}', ignored")
+
+    record_message(message_id, metadata["from_email"])
+
+
+# ================== EMAIL POLLING ================== #
+
+def uid_set(uids):
+    """[3, 4, 5, 9] -> '3:5,9' (IMAP sequence set, runs collapsed)."""
+    runs = []
+    for uid in uids:
+        if runs and uid == runs[-1][1] + 1:
+            runs[-1][1] = uid
+        else:
+            runs.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in runs)
+
+
+def poll_emails(session):
+    """
+    Ingest every UNSEEN message above the checkpoint, oldest first, in
+    batched UID FETCHes. Returns the number of messages ingested.
+    """
+    mail = session.conn
+    last_uid = get_last_uid(session.mailbox, session.uidvalidity)
+
+    criteria = f"UID {last_uid + 1}:* UNSEEN" if last_uid else "UNSEEN"
+    _, msgs = mail.uid("SEARCH", None, criteria)
+    # "n:*" always matches the highest UID, even when it is below n
+    uids = sorted(u for u in (int(x) for x in msgs[0].split()) if u > last_uid)
+
+    if not uids:
+        return 0
+
+    log(f"{len(uids)} unseen message(s) to ingest")
+
+    for i in range(0, len(uids), FETCH_BATCH):
+        batch = uids[i:i + FETCH_BATCH]
+        # Structure and the few headers we need; parts are fetched on demand
+        _, data = mail.uid("FETCH", uid_set(batch), f"(UID BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])")
+        messages = parse_fetch(data)
+
+        for uid in batch:
+            fields = messages.get(uid)
+            if fields is not None and "BODYSTRUCTURE" in fields:
+                headers = email.message_from_bytes(fetch_item(fields, "BODY[HEADER") or b"")
+                route_message(mail, uid, headers, body_parts(fields["BODYSTRUCTURE"]))
+                mail.uid("STORE", str(uid), "+FLAGS", "(\\Seen)")
+            save_last_uid(session.mailbox, session.uidvalidity, uid)
+
+    return len(uids)
 
 
 # ================== MAIN LOOP ================== #
 
 def run():
-    poll_interval = INITIAL_POLL
-    idle_logged = False
+    backoff = INITIAL_POLL
 
+    ensure_tables()
     log("Email ingestion service started")
 
+    # Leftovers of downloads interrupted by a crash; those messages are re-fetched
+    for name in os.listdir(PARTIAL):
+        os.remove(os.path.join(PARTIAL, name))
+
     while True:
         try:
-            found, poll_interval = poll_emails(poll_interval)
-
-            if found:
-                idle_logged = False
-            else:
-                if not idle_logged:
+            with MailboxSession(IMAP_SERVER, EMAIL_USER, EMAIL_PASS) as session:
+                log(f"Connected to {IMAP_SERVER} ({'IDLE push' if session.has_idle else f'NOOP every {INITIAL_POLL}s'})")
+                backoff = INITIAL_POLL
+
+                while True:
+                    # Drain everything unseen, then wait for the server to push more
+                    while poll_emails(session):
+                        pass
                     log("Waiting for new mail...")
-                    idle_logged = True
-
-            time.sleep(poll_interval)
+                    while not session.wait(INITIAL_POLL):
+                        pass
 
         except KeyboardInterrupt:
             log("Email ingestion stopped")
             break
 
         except Exception as e:
-            log(f"Error: {e}")
-            time.sleep(poll_interval)
+            log(f"Error: {e}; reconnecting in {backoff}s")
+            time.sleep(backoff)
+            backoff = min(backoff * 2, MAX_POLL)
 
 
 if __name__ == "__main__":
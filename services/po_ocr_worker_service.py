@@ -1,38 +1,132 @@
 import time
-import json
 import os
 import sys
+import signal
+import shutil
+import threading
+import multiprocessing as mp
 
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from core.po_ocr_worker import run_ocr
+from core.manifest_store import migrate_from_json, release_stale_claims, MANIFEST_CHANNEL
+from core.pg_notify import Wakeup, listen_forever
+from core.db_pool import ensure_tables
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 INCOMING = os.path.join(BASE_DIR, "incoming")
-MANIFEST = os.path.join(BASE_DIR, "manifest.json")
+PROCESSING = os.path.join(BASE_DIR, "processing")
 
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", "2"))
+# New files arrive via NOTIFY; this only catches files whose entry was
+# written while a listener was reconnecting
+FALLBACK_POLL = float(os.getenv("OCR_FALLBACK_POLL", "30"))      # seconds
+# A 'processing' claim with no heartbeat for this long belongs to a dead
+# worker (live ones touch theirs every OCR_CLAIM_HEARTBEAT seconds)
+CLAIM_TIMEOUT = int(os.getenv("OCR_CLAIM_TIMEOUT", "1800"))      # seconds
+# Load PaddleOCR when a worker starts instead of on its first scanned page
+OCR_WARMUP = os.getenv("OCR_WARMUP", "1") == "1"
+STALE_CHECK_INTERVAL = 60                                         # seconds
+
+
+# ================= WORKER PROCESS ================= #
+
+def worker_main(stop_event):
+    """
+    One OCR worker process. Imports core.po_ocr_worker here, not in the
+    parent, so each process holds its own PaddleOCR model, loaded once.
+    """
+    # The parent coordinates shutdown; a SIGTERM sent to the whole group
+    # only means "finish the current file"
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    from core.po_ocr_worker import run_next_pending, warm_up_ocr
+
+    if OCR_WARMUP:
+        warm_up_ocr()
+
+    wakeup = Wakeup()
+    threading.Thread(
+        target=listen_forever,
+        args=([MANIFEST_CHANNEL], lambda _n: wakeup.signal(), stop_event),
+        name="listener",
+        daemon=True
+    ).start()
+
+    name = mp.current_process().name
+    print(f"[{name}] ready (pid {os.getpid()})", flush=True)
+
+    while not stop_event.is_set():
+        seen = wakeup.generation()
+        try:
+            if run_next_pending():
+                continue
+        except Exception as e:
+            print(f"[{name}] error: {e}", flush=True)
+
+        # Idle: sleep until NOTIFY, fallback timeout or shutdown
+        deadline = time.monotonic() + FALLBACK_POLL
+        while not stop_event.is_set() and time.monotonic() < deadline:
+            if wakeup.wait(seen, 1.0):
+                break
+
+    print(f"[{name}] drained, exiting", flush=True)
 
-def load_manifest():
-    try:
-        with open(MANIFEST) as f:
-            return json.load(f)
-    except:
-        return {}
+
+# ================= SUPERVISOR ================= #
+
+def requeue_stale():
+    for f in release_stale_claims(CLAIM_TIMEOUT):
+        proc = os.path.join(PROCESSING, f)
+        if os.path.exists(proc):
+            shutil.move(proc, os.path.join(INCOMING, f))
+        print(f"♻️ Requeued stale OCR claim: {f}")
 
 
 def run():
-    print(f"OCR service started. Watching: {INCOMING}")
-    while True:
-        manifest = load_manifest()
-        for f, v in manifest.items():
-            if v.get("status") == "pending":
-                file_path = os.path.join(INCOMING, f)
-                if os.path.exists(file_path):
-                    run_ocr(f)
-        time.sleep(2)
+    ensure_tables()
+    imported = migrate_from_json()
+    if imported:
+        print(f"📦 Imported {imported} entries from manifest.json")
+
+    requeue_stale()
+
+    # spawn: children must not inherit the parent's DB sockets or OCR state
+    ctx = mp.get_context("spawn")
+    stop_event = ctx.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+
+    workers = [
+        ctx.Process(target=worker_main, args=(stop_event,), name=f"ocr-{i + 1}")
+        for i in range(OCR_WORKERS)
+    ]
+    for w in workers:
+        w.start()
+
+    print(f"OCR service started with {OCR_WORKERS} worker(s). Watching: {INCOMING}")
+
+    try:
+        while not stop_event.wait(STALE_CHECK_INTERVAL):
+            try:
+                requeue_stale()
+            except Exception as e:
+                print(f"Stale claim check failed: {e}")
+
+            for i, w in enumerate(workers):
+                if not w.is_alive() and not stop_event.is_set():
+                    print(f"⚠️ {w.name} exited ({w.exitcode}), restarting")
+                    workers[i] = ctx.Process(target=worker_main, args=(stop_event,), name=w.name)
+                    workers[i].start()
+    except KeyboardInterrupt:
+        stop_event.set()
+
+    print("Draining OCR workers (finishing in-flight files)...")
+    for w in workers:
+        w.join()
+    print("OCR service stopped")
 
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
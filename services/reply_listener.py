@@ -1,11 +1,6 @@
-import imaplib
-import email
-import time
+import signal
+import threading
 from dotenv import load_dotenv
-import requests
-from email.header import decode_header
-import re
-from datetime import datetime
 import sys
 import os
 
@@ -15,18 +10,23 @@ load_dotenv()
 # Add project root to sys.path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from config.db_config import DB_CONFIG
-import psycopg2
+from core.job_queue import (
+    claim_job, complete_job, fail_job, hold_job, submit_job,
+    JOB_PARTIAL_RESPONSE, JOB_CUSTOMER_REPLY, AGENT_JOBS_CHANNEL
+)
+from core.pg_notify import Wakeup, listen_forever
+from core.db_pool import close_pool, ensure_tables
+from core import llm_client
 
-# Gmail Credentials from environment
-IMAP_SERVER = "imap.gmail.com"
-EMAIL_USER = os.getenv("EMAIL_USER")
-EMAIL_PASS = os.getenv("EMAIL_PASS")
+# Replies are no longer read from IMAP here: services/email_ingestion_imap.py
+# routes them (core/mail_router.py) as customer_reply jobs on agent_jobs.
+FALLBACK_POLL = 60        # seconds; NOTIFY normally wakes us first
+ERROR_BACKOFF = 5         # seconds
 
-OLLAMA_URL = "http://localhost:11434/api/generate"
+INTENT_MODEL = "qwen2.5:7b"
 
-def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+stop_event = threading.Event()
+wakeup = Wakeup()
 
 def classify_intent(email_body):
     """
@@ -48,14 +48,12 @@ def classify_intent(email_body):
     """
     
     try:
-        res = requests.post(OLLAMA_URL, json={
-            "model": "qwen2.5:7b",
-            "prompt": prompt,
-            "stream": False,
-            "options": {"temperature": 0} # Deterministic
-        }, timeout=30)
-        
-        intent = res.json().get("response", "").strip().upper()
+        intent = llm_client.generate(
+            prompt,
+            INTENT_MODEL,
+            options={"temperature": 0, "num_predict": 8}, # Deterministic, one word
+            timeout=30
+        ).strip().upper()
         
         # Cleanup potential extra text
         if "APPROVE" in intent: return "APPROVE"
@@ -66,85 +64,72 @@ def classify_intent(email_body):
         print(f"LLM Classification Error: {e}")
         return "OTHER"
 
-def find_po_in_subject(subject):
-    """
-    Extract PO number from subject (assuming format like "Re: Proposal for PO-1234")
-    """
-    # Simple regex for PO-XXXX or just finding numbers if strictly formatted
-    # Adjust based on your PO Number format
-    match = re.search(r"(PO-\w+|[0-9]+)", subject, re.IGNORECASE)
-    if match:
-        return match.group(1)
-    return None
-
-def process_replies():
-    print("📧 Checking for replies...")
-    
-    mail = imaplib.IMAP4_SSL(IMAP_SERVER)
-    mail.login(EMAIL_USER, EMAIL_PASS)
-    mail.select("INBOX")
-    
-    # Search for UNSEEN emails
-    status, messages = mail.search(None, 'UNSEEN')
-    
-    if not messages[0]:
-        print("No new emails.")
-        return
-
-    for mail_id in messages[0].split():
-        _, msg_data = mail.fetch(mail_id, '(RFC822)')
-        for response_part in msg_data:
-            if isinstance(response_part, tuple):
-                msg = email.message_from_bytes(response_part[1])
-                subject, encoding = decode_header(msg["Subject"])[0]
-                if isinstance(subject, bytes):
-                    subject = subject.decode(encoding or "utf-8")
-                
-                print(f"Processing: {subject}")
-                
-                # extracting plain text body
-                body = ""
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        if part.get_content_type() == "text/plain":
-                            body = part.get_payload(decode=True).decode()
-                            break
-                else:
-                    body = msg.get_payload(decode=True).decode()
-
-                # 1. Identify PO
-                po_number = find_po_in_subject(subject)
-                if not po_number:
-                    # Fallback: check if the PO number is in the body
-                    match = re.search(r"(PO-\w+|[0-9]{4,})", body, re.IGNORECASE)
-                    if match:
-                        po_number = match.group(1)
-
-                if not po_number:
-                    print(f"Skipping: No PO number found in subject or body for '{subject}'")
-                    continue
-
-                # 2. Classify Intent
-                intent = classify_intent(body)
-                print(f"Detected Intent: {intent} for PO {po_number}")
-                
-                # 3. Trigger Agent Action
-                if intent in ["APPROVE", "REJECT"]:
-                    from core.optimized_agent import handle_partial_response
-                    handle_partial_response(po_number, intent)
-                    
-                    # Mark email as seen only if processed
-                    mail.store(mail_id, '+FLAGS', '\\Seen')
+def handle_reply(job):
+    """Returns True if a decision was queued, False if a human has to read the reply."""
+    payload = job["payload"]
+    print(f"Processing: {payload.get('subject', '')} (PO {job['po_id']})")
+
+    intent = classify_intent(payload.get("body", ""))
+    print(f"Detected Intent: {intent} for PO {job['po_id']}")
+
+    # Queue Agent Action (agent workers are woken by NOTIFY on commit)
+    if intent in ["APPROVE", "REJECT"]:
+        job_id = submit_job(JOB_PARTIAL_RESPONSE, job["po_id"], {"decision": intent})
+        print(f"Queued {intent} for PO {job['po_id']} (job {job_id})")
+        return True
+
+    print(f"Intent unclear. Manual review needed (from {payload.get('from_email')}, {payload.get('message_id')}).")
+    return False
+
+
+def run():
+    ensure_tables()
+
+    # docker stop / pkill send SIGTERM: finish the current reply, then exit
+    def shutdown(*_):
+        stop_event.set()
+        wakeup.signal()
+
+    signal.signal(signal.SIGTERM, shutdown)
+
+    threading.Thread(
+        target=listen_forever,
+        args=([AGENT_JOBS_CHANNEL], lambda _n: wakeup.signal(), stop_event),
+        name="listener",
+        daemon=True
+    ).start()
+
+    print("📧 Reply listener started (customer_reply jobs from the mailbox service)")
+
+    try:
+        while not stop_event.is_set():
+            seen = wakeup.generation()
+            try:
+                job = claim_job([JOB_CUSTOMER_REPLY])
+            except Exception as e:
+                print(f"Error in reply listener loop: {e}")
+                stop_event.wait(ERROR_BACKOFF)
+                continue
+
+            if not job:
+                wakeup.wait(seen, FALLBACK_POLL)
+                continue
+
+            try:
+                if handle_reply(job):
+                    complete_job(job["job_id"])
                 else:
-                    print("Intent unclear. Manual review needed.")
+                    # Ingestion already marked the email Seen: keep it findable in agent_jobs
+                    hold_job(job["job_id"], "Reply intent unclear, needs manual review")
+            except Exception as e:
+                final = fail_job(job, e)
+                print(f"Reply job {job['job_id']} failed{' permanently' if final else ', will retry'}: {e}")
+    except KeyboardInterrupt:
+        stop_event.set()
+
+    close_pool()
+    print("Reply listener stopped")
 
-    mail.close()
-    mail.logout()
 
 if __name__ == "__main__":
-    while True:
-        try:
-            process_replies()
-        except Exception as e:
-            print(f"Error in reply listener loop: {e}")
-        time.sleep(30)
+    run()
@@ -11,7 +11,7 @@ echo "🚀 Starting PO Pipeline Project..."
 nohup $VENV_PYTHON flask_app/app.py > $LOG_DIR/flask.log 2>&1 &
 echo "✅ Flask App started (PID $!)"
 
-# 2. Start Email Ingestion
+# 2. Start Email Ingestion (the one IMAP client; routes replies to the Reply Listener)
 nohup $VENV_PYTHON services/email_ingestion_imap.py > $LOG_DIR/ingestion.log 2>&1 &
 echo "✅ Email Ingestion started (PID $!)"
 
@@ -19,11 +19,15 @@ echo "✅ Email Ingestion started (PID $!)"
 nohup $VENV_PYTHON services/po_ocr_worker_service.py > $LOG_DIR/ocr.log 2>&1 &
 echo "✅ OCR Worker started (PID $!)"
 
-# 4. Start Reply Listener
+# 4. Start Agent Worker
+nohup $VENV_PYTHON services/agent_worker_service.py > $LOG_DIR/agent.log 2>&1 &
+echo "✅ Agent Worker started (PID $!)"
+
+# 5. Start Reply Listener (customer_reply jobs)
 nohup $VENV_PYTHON services/reply_listener.py > $LOG_DIR/reply_listener.log 2>&1 &
 echo "✅ Reply Listener started (PID $!)"
 
-# 5. Start Scheduler
+# 6. Start Scheduler
 nohup $VENV_PYTHON services/scheduler.py > $LOG_DIR/scheduler.log 2>&1 &
 echo "✅ Scheduler started (PID $!)"
 
@@ -6,6 +6,7 @@ echo "🛑 Stopping PO Pipeline Project..."
 pkill -f "flask_app/app.py"
 pkill -f "services/email_ingestion_imap.py"
 pkill -f "services/po_ocr_worker_service.py"
+pkill -f "services/agent_worker_service.py"
 pkill -f "services/reply_listener.py"
 pkill -f "services/scheduler.py"
 